@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Shared FTP connection handling for the native Python FTP lister and downloader.
+Owns connect/login/TLS setup, socket tuning and safe teardown.
+"""
+
+import ftplib
+import random
+import socket
+import ssl
+import sys
+import logging
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+TCP_RCVBUF = 16 * 1024 * 1024  # Kernel receive buffer requested on FTP sockets
+
+# Control channel is decoded as latin-1 (a lossless byte<->char mapping);
+# names are converted to/from the filesystem encoding only at the API boundary
+WIRE_ENCODING = 'latin-1'
+FS_ENCODING = sys.getfilesystemencoding()
+
+# Errors that mean the control connection is gone and a reconnect may help
+TRANSIENT_ERRORS = (EOFError, ConnectionResetError, BrokenPipeError, socket.timeout, ftplib.error_temp)
+
+
+def backoff_delay(base: float, attempt: int, cap: float = 600) -> float:
+    """Exponential backoff for retry `attempt` (1-based) with jitter, so retries don't arrive in lockstep."""
+    return min(base * 2 ** (attempt - 1), cap) * (0.5 + random.random())
+
+
+def to_wire(name: str) -> str:
+    """Filesystem-encoded name/path -> string ftplib sends verbatim as latin-1."""
+    return name.encode(FS_ENCODING, 'surrogateescape').decode(WIRE_ENCODING)
+
+
+def from_wire(name: str) -> str:
+    """Name as read off the latin-1 control/listing stream -> filesystem-encoded string."""
+    return name.encode(WIRE_ENCODING).decode(FS_ENCODING, 'surrogateescape')
+
+
+def _read_rmem_max() -> Optional[int]:
+    """Kernel cap for SO_RCVBUF (Linux), or None if unknown."""
+    try:
+        with open('/proc/sys/net/core/rmem_max') as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+# An explicit SO_RCVBUF disables Linux receive-buffer autotuning, so only set it
+# when the kernel will actually grant TCP_RCVBUF - otherwise autotuning does better
+_SET_RCVBUF = (_read_rmem_max() or TCP_RCVBUF) >= TCP_RCVBUF
+
+
+def _tune_socket(sock) -> None:
+    """Disable Nagle and enlarge the receive buffer on an FTP socket."""
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if _SET_RCVBUF:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, TCP_RCVBUF)
+    except OSError as e:
+        logger.debug(f"Could not tune socket: {e}")
+
+
+class _TunedTransferMixin:
+    """Applies _tune_socket to every data connection ftplib opens."""
+
+    def ntransfercmd(self, cmd, rest=None):
+        conn, size = super().ntransfercmd(cmd, rest)
+        _tune_socket(conn)
+        return conn, size
+
+
+class _FTP(_TunedTransferMixin, ftplib.FTP):
+    pass
+
+
+def _make_tls_context() -> ssl.SSLContext:
+    """Client context matching ftplib's default (no certificate checks), TLS 1.2+."""
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    ctx.check_hostname = False
+    ctx.verify_mode = ssl.CERT_NONE
+    ctx.minimum_version = ssl.TLSVersion.TLSv1_2
+    return ctx
+
+
+# One context for every connection so TLS sessions can be resumed across sockets
+_TLS_CTX = _make_tls_context()
+# Last TLS session per (host, port), offered again on reconnect
+_TLS_SESSIONS: Dict[Tuple[str, int], ssl.SSLSession] = {}
+
+
+class _FTP_TLS(ftplib.FTP_TLS):
+    """
+    FTP_TLS on the shared context that resumes TLS sessions: reconnects offer the
+    previous control session and data connections reuse the control session,
+    skipping the full handshake each time.
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('context', _TLS_CTX)
+        super().__init__(*args, **kwargs)
+
+    def auth(self):
+        """Set up secure control connection, resuming a cached session if any."""
+        if isinstance(self.sock, ssl.SSLSocket):
+            raise ValueError("Already using TLS")
+        resp = self.voidcmd('AUTH TLS')
+        self.sock = self.context.wrap_socket(self.sock, server_hostname=self.host,
+                                             session=_TLS_SESSIONS.get((self.host, self.port)))
+        self.file = self.sock.makefile(mode='r', encoding=self.encoding)
+        return resp
+
+    def login(self, *args, **kwargs):
+        resp = super().login(*args, **kwargs)
+        # TLS 1.3 tickets arrive after the handshake, so grab the session once replies were read
+        if isinstance(self.sock, ssl.SSLSocket) and self.sock.session is not None:
+            _TLS_SESSIONS[(self.host, self.port)] = self.sock.session
+        return resp
+
+    def ntransfercmd(self, cmd, rest=None):
+        conn, size = ftplib.FTP.ntransfercmd(self, cmd, rest)
+        _tune_socket(conn)
+        if self._prot_p:
+            conn = self.context.wrap_socket(conn, server_hostname=self.host,
+                                            session=self.sock.session)
+        return conn, size
+
+
+class FTPConnection:
+    """
+    One authenticated FTP (TLS) control connection.
+    Usable as a context manager: connects on enter, disconnects on exit.
+    """
+    connect_timeout = 600  # seconds; also applies to data connections
+    binary_on_connect = True  # send TYPE I right after login
+
+    def __init__(self, host: str, user: str, password: str, port: int = 21, use_tls: bool = True):
+        self.host = host
+        self.user = user
+        self.password = password
+        self.port = port
+        self.use_tls = use_tls
+        self.ftp = None
+        self._binary = False  # TYPE I already sent on this session
+
+    def __enter__(self):
+        if not self.connect():
+            raise ConnectionError(f"Could not connect to {self.host}:{self.port}")
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.disconnect()
+        return False
+
+    def connect(self):
+        """Connect to FTP server with TLS."""
+        try:
+            if self.use_tls:
+                self.ftp = _FTP_TLS(encoding=WIRE_ENCODING)
+            else:
+                self.ftp = _FTP(encoding=WIRE_ENCODING)
+
+            logger.info(f"Connecting to {self.host}:{self.port}...")
+            # Long timeout for slow connections
+            self.ftp.connect(self.host, self.port, timeout=self.connect_timeout)
+            _tune_socket(self.ftp.sock)
+            self.ftp.login(self.user, self.password)
+
+            if self.use_tls:
+                self.ftp.prot_p()  # Enable encryption for data channel
+
+            if self.binary_on_connect:
+                self._ensure_binary()
+
+            logger.info(f"✅ Connected to {self.host}")
+            return True
+
+        except Exception as e:
+            logger.error(f"Failed to connect: {e}")
+            return False
+
+    def disconnect(self):
+        """Safely disconnect from FTP server."""
+        if self.ftp is None:
+            return
+        # Only say QUIT on a control socket that is still open; close() is idempotent
+        sock = self.ftp.sock
+        if sock is not None and not getattr(sock, '_closed', False):
+            try:
+                self.ftp.quit()
+            except ftplib.all_errors:
+                pass
+        self.ftp.close()
+        self.ftp = None
+        self._binary = False
+
+    def reconnect(self) -> bool:
+        """Drop the current connection and log in again."""
+        self.disconnect()
+        return self.connect()
+
+    def is_alive(self) -> bool:
+        """Check the control connection with a NOOP."""
+        if self.ftp is None:
+            return False
+        try:
+            self.ftp.voidcmd('NOOP')
+            return True
+        except TRANSIENT_ERRORS + (OSError, ftplib.error_reply, ftplib.error_perm):
+            return False
+
+    def _ensure_binary(self):
+        """Send TYPE I unless this session is already in binary mode."""
+        if not self._binary:
+            self.ftp.voidcmd('TYPE I')
+            self._binary = True
@@ -4,81 +4,269 @@ Native Python FTP downloader with resume support.
 Much more reliable than rclone for large file transfers.
 """
 
+import errno
 import ftplib
+import hashlib
 import os
+import queue
+import select
 import socket
+import ssl
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 from pathlib import Path
 import logging
 import time
-from typing import Optional
+from typing import List, Optional
+
+from ftp_connection import FTPConnection, backoff_delay, to_wire
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+try:
+    # fallocate(2) is only reachable through libc - os.posix_fallocate can't keep the file size
+    import ctypes
+    _fallocate = ctypes.CDLL(None, use_errno=True).fallocate
+    _fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+except (ImportError, AttributeError, OSError, TypeError):  # Not Linux/glibc
+    _fallocate = None
+FALLOC_FL_KEEP_SIZE = 0x01
 
 logger = logging.getLogger(__name__)
 
-class FTPDownloader:
-    def __init__(self, host: str, user: str, password: str, port: int = 21, use_tls: bool = True):
-        self.host = host
-        self.user = user
-        self.password = password
-        self.port = port
-        self.use_tls = use_tls
-        self.ftp = None
-        
-    def connect(self):
-        """Connect to FTP server with TLS."""
+RECV_SIZE = 1024 * 1024  # 1MB per recv() on the data socket
+MIN_BLOCK_SIZE = 256 * 1024  # Adaptive write block: starting size...
+MAX_BLOCK_SIZE = 16 * 1024 * 1024  # ...and ceiling
+BLOCK_ADAPT_INTERVAL = 2.0  # seconds of throughput measured before resizing the block
+PROGRESS_LOG_BYTES = 64 * 1024 * 1024  # Log progress every 64MB
+PARALLEL_LOG_INTERVAL = 30  # seconds between progress lines for segmented downloads
+WRITE_QUEUE_DEPTH = 8  # chunks buffered between the socket reader and the disk writer
+# splice(2) errors meaning the kernel or filesystem can't splice these fds at all
+_SPLICE_UNSUPPORTED = frozenset((errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP))
+_INV_GB = 1.0 / (1024**3)
+_INV_MB = 1.0 / (1024**2)
+
+
+def _open_output(local_path: Path, resume_pos: int, remote_size: int) -> int:
+    """
+    Open the download target as a raw fd positioned at resume_pos.
+    Reserves disk blocks for the rest of the file where the OS supports it,
+    without changing the file size: the size on disk stays the number of bytes
+    actually written, so a killed download still resumes from the right place.
+    """
+    fd = os.open(str(local_path), os.O_WRONLY | os.O_CREAT | getattr(os, 'O_BINARY', 0), 0o644)
+    os.lseek(fd, resume_pos, os.SEEK_SET)
+    if _fallocate is not None and remote_size > resume_pos:
+        if _fallocate(fd, FALLOC_FL_KEEP_SIZE, resume_pos, remote_size - resume_pos) != 0:
+            # Not all filesystems support fallocate - just write normally
+            logger.debug(f"fallocate not available: {os.strerror(ctypes.get_errno())}")
+    return fd
+
+
+def _write_all(fd: int, data) -> None:
+    """os.write until every byte of data has been written."""
+    view = memoryview(data)
+    while view:
+        written = os.write(fd, view)
+        view = view[written:]
+
+
+def _pwrite_all(fd: int, data, offset: int) -> None:
+    """os.pwrite until every byte of data has been written at offset."""
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view = view[written:]
+        offset += written
+
+
+def _splice_chunks(conn, fd: int, chunk_size: int, fallback):
+    """
+    Move data from a plain TCP data socket into fd with os.splice (socket -> pipe
+    -> file) so payload bytes never pass through Python. Yields bytes per chunk.
+    If the first chunk can't be spliced (no splice support for the socket or the
+    target filesystem), whatever already sits in the pipe is copied out by hand
+    and the rest of the transfer is read from fallback() instead.
+    """
+    pipe_r, pipe_w = os.pipe()
+    try:
+        if hasattr(fcntl, 'F_SETPIPE_SZ'):  # Linux; the default pipe is only 64KB
+            try:
+                fcntl.fcntl(pipe_w, fcntl.F_SETPIPE_SZ, chunk_size)
+            except OSError:
+                pass  # Above /proc/sys/fs/pipe-max-size - keep the default
+        timeout = conn.gettimeout()
+        spliced = False
+        while True:
+            n = pending = 0
+            try:
+                try:
+                    n = os.splice(conn.fileno(), pipe_w, chunk_size)
+                except BlockingIOError:
+                    # Sockets with a timeout are non-blocking underneath
+                    if not select.select([conn], [], [], timeout)[0]:
+                        raise socket.timeout("timed out")
+                    continue
+                if not n:
+                    return
+                pending = n
+                while pending:
+                    pending -= os.splice(pipe_r, fd, pending)
+            except OSError as e:
+                if spliced or e.errno not in _SPLICE_UNSUPPORTED:
+                    raise
+                logger.info(f"splice not supported here ({e}) - reading the socket instead")
+                while pending:
+                    data = os.read(pipe_r, pending)
+                    _write_all(fd, data)
+                    pending -= len(data)
+                if n:
+                    yield n
+                break
+            spliced = True
+            yield n
+    finally:
+        os.close(pipe_r)
+        os.close(pipe_w)
+    yield from fallback()
+
+
+def _recv_blocks(conn, writer: '_BackgroundWriter', block_size: Optional[int] = None):
+    """
+    Fill blocks from the data socket with recv_into and queue them on writer.
+    TLS sockets hand back at most one 16KB record per call, so a block takes
+    many recvs but only one queue hand-off and one write.
+    With block_size None the block starts at MIN_BLOCK_SIZE and doubles every
+    BLOCK_ADAPT_INTERVAL while throughput still improves by >10%, up to MAX_BLOCK_SIZE.
+    Yields bytes per block.
+    """
+    adaptive = block_size is None
+    size = MIN_BLOCK_SIZE if adaptive else block_size
+    window_start = time.monotonic()
+    window_bytes = 0
+    last_speed = 0.0
+    
+    while True:
+        # Reuse a buffer the writer has finished with (double-buffering once two
+        # are in flight); buffers from before the block size grew are dropped
         try:
-            if self.use_tls:
-                self.ftp = ftplib.FTP_TLS()
-            else:
-                self.ftp = ftplib.FTP()
-            
-            # Set long timeout for slow connections
-            self.ftp.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.ftp.sock.settimeout(600)  # 10 minute timeout
-            
-            logger.info(f"Connecting to {self.host}:{self.port}...")
-            self.ftp.connect(self.host, self.port)
-            self.ftp.login(self.user, self.password)
-            
-            if self.use_tls:
-                self.ftp.prot_p()  # Enable encryption for data channel
-            
-            # Set binary mode
-            self.ftp.voidcmd('TYPE I')
-            
-            logger.info(f"✅ Connected to {self.host}")
-            return True
-            
-        except Exception as e:
-            logger.error(f"Failed to connect: {e}")
-            return False
+            buf = writer.free.get_nowait()
+        except queue.Empty:
+            buf = None
+        if buf is None or len(buf) != size:
+            buf = bytearray(size)
+        view = memoryview(buf)
+        filled = 0
+        while filled < size:
+            n = conn.recv_into(view[filled:])
+            if not n:
+                break
+            filled += n
+        if filled:
+            writer.write(view[:filled])
+            yield filled
+        if filled < size:
+            return  # EOF
+        
+        if adaptive:
+            window_bytes += filled
+            now = time.monotonic()
+            if now - window_start >= BLOCK_ADAPT_INTERVAL:
+                speed = window_bytes / (now - window_start)
+                if speed > 1.1 * last_speed and size < MAX_BLOCK_SIZE:
+                    size *= 2
+                    last_speed = speed
+                else:
+                    adaptive = False  # Plateaued - keep the current size
+                    logger.debug(f"Block size settled at {size // 1024}KB ({speed * _INV_MB:.1f}MB/s)")
+                window_start = now
+                window_bytes = 0
+
+
+def _hash_prefix(local_path: Path, length: int, hasher) -> None:
+    """Feed the first length bytes of an existing partial download to hasher."""
+    with open(local_path, 'rb') as f:
+        while length > 0:
+            data = f.read(min(RECV_SIZE, length))
+            if not data:
+                raise OSError(f"{local_path} is shorter than expected")
+            hasher.update(data)
+            length -= len(data)
+
+
+class _BackgroundWriter:
+    """
+    Appends chunks to fd from a separate thread so a slow disk doesn't stall recv().
+    Optionally hashes them on the way, so the file never has to be read back for it.
+    The bounded queue caps memory at WRITE_QUEUE_DEPTH chunks. Once written, the
+    bytearray behind a memoryview chunk is handed back on .free for reuse.
+    """
     
-    def disconnect(self):
-        """Safely disconnect from FTP server."""
-        if self.ftp:
+    def __init__(self, fd: int, depth: int = WRITE_QUEUE_DEPTH, hasher=None):
+        self.fd = fd
+        self.hasher = hasher  # Optional hashlib object fed every written chunk
+        self.written = 0
+        self.error: Optional[OSError] = None
+        self._queue = queue.Queue(maxsize=depth)
+        self.free = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+    
+    def _run(self):
+        while True:
+            data = self._queue.get()
+            if data is None:
+                return
+            if self.error is not None:
+                continue  # Keep draining so the reader never blocks on a full queue
             try:
-                self.ftp.quit()
-            except:
-                try:
-                    self.ftp.close()
-                except:
-                    pass
-            self.ftp = None
+                _write_all(self.fd, data)
+                self.written += len(data)
+                if self.hasher is not None:
+                    self.hasher.update(data)
+                if isinstance(data, memoryview):
+                    self.free.put(data.obj)
+            except OSError as e:
+                self.error = e
+    
+    def write(self, data):
+        if self.error is not None:
+            raise self.error
+        self._queue.put(data)
+    
+    def close(self):
+        """Wait for queued chunks to hit the disk and stop the thread."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+
+class FTPDownloader(FTPConnection):
+    connect_timeout = 600  # 10 minute timeout (also applies to data connections)
+    sha1_hex: Optional[str] = None  # SHA-1 of the last file fetched by download_file(sha1=True)
     
     def get_file_size(self, remote_path: str) -> Optional[int]:
         """Get remote file size."""
         try:
-            self.ftp.voidcmd('TYPE I')
-            size = self.ftp.size(remote_path)
+            self._ensure_binary()
+            size = self.ftp.size(to_wire(remote_path))
             return size
         except Exception as e:
             logger.warning(f"Could not get file size: {e}")
             return None
     
-    def download_file(self, remote_path: str, local_path: Path, chunk_size: int = 4*1024*1024) -> bool:
+    def download_file(self, remote_path: str, local_path: Path, chunk_size: Optional[int] = None,
+                      sha1: bool = False) -> bool:
         """
         Download file with resume support.
         Uses FTP REST command to resume from partial downloads.
+        chunk_size None sizes write blocks adaptively.
+        sha1=True hashes the data as it is written and leaves the digest in self.sha1_hex.
         """
+        self.sha1_hex = None
         local_path = Path(local_path)
         local_path.parent.mkdir(parents=True, exist_ok=True)
         
@@ -90,7 +278,8 @@ class FTPDownloader:
         
         logger.info(f"Remote file size: {remote_size / (1024**3):.2f}GB")
         
-        # Check for partial download
+        # Check for partial download - the file only ever grows by written bytes
+        # (space is reserved with FALLOC_FL_KEEP_SIZE), so its size is a safe resume point
         resume_pos = 0
         if local_path.exists():
             resume_pos = local_path.stat().st_size
@@ -100,72 +289,96 @@ class FTPDownloader:
             elif resume_pos > 0:
                 logger.info(f"🔄 Resuming from {resume_pos / (1024**3):.2f}GB")
         
-        # Open file in append mode if resuming, write mode otherwise
-        mode = 'ab' if resume_pos > 0 else 'wb'
-        
         try:
-            with open(local_path, mode) as f:
-                # Send REST command to resume from position
-                # 350 is intermediate response (pending) - means "send RETR now"
-                if resume_pos > 0:
-                    try:
-                        # Send REST command - 350 response is expected and valid
-                        resp = self.ftp.sendcmd(f'REST {resume_pos}')
-                        # 350 response means "restart accepted, send RETR now"
-                        if resp.startswith('350'):
-                            logger.info(f"✓ REST accepted - server ready for RETR (resuming from {resume_pos / (1024**3):.2f}GB)")
-                        elif resp.startswith('200'):
-                            logger.info(f"✓ REST accepted (200 response): {resp}")
-                        else:
-                            logger.warning(f"Unexpected REST response: {resp}")
-                    except ftplib.error_reply as e:
-                        # Check if it's a 350 response (which is valid!)
-                        error_str = str(e)
-                        if '350' in error_str or '350 Restarting' in error_str:
-                            logger.info(f"✓ REST accepted (350 intermediate response) - server waiting for RETR")
-                        else:
-                            logger.error(f"REST command failed: {e}")
-                            return False
-                    except Exception as e:
-                        error_str = str(e)
-                        if '350' in error_str:
-                            logger.info(f"✓ REST accepted (350 found in error) - continuing")
-                        else:
-                            logger.error(f"REST command failed: {e}")
-                            return False
-                
-                # Start transfer
-                start_time = time.time()
-                last_update = start_time
-                bytes_downloaded = resume_pos
-                
-                def callback(data):
-                    nonlocal bytes_downloaded, last_update
-                    f.write(data)
-                    bytes_downloaded += len(data)
-                    
-                    # Progress update every 5 seconds
-                    now = time.time()
-                    if now - last_update >= 5:
-                        elapsed = now - start_time
-                        speed_mbps = ((bytes_downloaded - resume_pos) / elapsed) / (1024**2)
-                        progress_pct = (bytes_downloaded / remote_size) * 100
-                        eta_seconds = (remote_size - bytes_downloaded) / (speed_mbps * 1024**2) if speed_mbps > 0 else 0
-                        
-                        logger.info(f"📥 {progress_pct:.1f}% - {bytes_downloaded / (1024**3):.2f}/{remote_size / (1024**3):.2f}GB - {speed_mbps:.1f}MB/s - ETA {eta_seconds/60:.0f}m")
-                        last_update = now
-                
+            hasher = None
+            if sha1:
+                hasher = hashlib.sha1()
+                if resume_pos:
+                    # Before the fd is opened, so a failure here has nothing to close
+                    _hash_prefix(local_path, resume_pos, hasher)
+            # Write through a raw fd (no BufferedWriter copy) and reserve the
+            # remaining extent up front so the file doesn't fragment as it grows
+            fd = _open_output(local_path, resume_pos, remote_size)
+            writer = None
+            writer_start = resume_pos
+            
+            # Start transfer
+            start_time = time.monotonic()
+            bytes_downloaded = resume_pos
+            # Loop-invariant parts of the progress line; with INFO disabled the
+            # progress branch is never taken
+            remote_gb = remote_size * _INV_GB
+            pct_per_byte = 100.0 / remote_size if remote_size else 0.0
+            next_log_at = resume_pos + PROGRESS_LOG_BYTES if logger.isEnabledFor(logging.INFO) else float('inf')
+            
+            try:
                 # Retrieve file with longer timeout for large files
                 # Increase socket timeout during transfer
                 self.ftp.sock.settimeout(1800)  # 30 minutes for large file transfers
-                self.ftp.retrbinary(f'RETR {remote_path}', callback, blocksize=chunk_size)
                 
+                # ntransfercmd sends REST right after PASV, so the 350 reply lands
+                # immediately before RETR as the server expects
+                try:
+                    conn, _ = self.ftp.ntransfercmd(f'RETR {to_wire(remote_path)}', rest=resume_pos or None)
+                except ftplib.error_reply as e:
+                    logger.error(f"REST command failed: {e}")
+                    return False
+                if resume_pos > 0:
+                    logger.info(f"✓ REST accepted - resuming from {resume_pos / (1024**3):.2f}GB")
+                
+                # Read the data socket directly instead of going through retrbinary's
+                # per-block callback. Plain TCP is spliced straight into the file by
+                # the kernel; TLS is decrypted in Python and written on a writer thread
+                def recv_chunks():
+                    nonlocal writer, writer_start
+                    writer_start = bytes_downloaded  # Bytes spliced before a fallback are already on disk
+                    writer = _BackgroundWriter(fd, hasher=hasher)
+                    return _recv_blocks(conn, writer, chunk_size)
+                
+                if hasattr(os, 'splice') and hasher is None and not isinstance(conn, ssl.SSLSocket):
+                    chunks = _splice_chunks(conn, fd, chunk_size or RECV_SIZE, fallback=recv_chunks)
+                else:
+                    chunks = recv_chunks()
+                try:
+                    for n in chunks:
+                        bytes_downloaded += n
+                        
+                        # Progress update every PROGRESS_LOG_BYTES - a single compare per
+                        # chunk, the clock is only read when a line is actually logged
+                        if bytes_downloaded >= next_log_at:
+                            now = time.monotonic()
+                            elapsed = now - start_time
+                            bytes_this_run = bytes_downloaded - resume_pos
+                            bytes_per_sec = bytes_this_run / elapsed if elapsed > 0 else 0
+                            eta_seconds = (remote_size - bytes_downloaded) * elapsed / max(1, bytes_this_run)
+                            
+                            logger.info(f"📥 {bytes_downloaded * pct_per_byte:.1f}% - {bytes_downloaded * _INV_GB:.2f}/{remote_gb:.2f}GB - {bytes_per_sec * _INV_MB:.1f}MB/s - ETA {eta_seconds/60:.0f}m")
+                            next_log_at = bytes_downloaded + PROGRESS_LOG_BYTES
+                    
+                    if isinstance(conn, ssl.SSLSocket):
+                        conn.unwrap()
+                finally:
+                    chunks.close()
+                    conn.close()
+                self.ftp.voidresp()
+            finally:
+                if writer is not None:
+                    writer.close()
+                    bytes_downloaded = writer_start + writer.written
+                # Release the reserved blocks we didn't fill
+                os.ftruncate(fd, bytes_downloaded)
+                os.close(fd)
+            if writer is not None and writer.error is not None:
+                raise writer.error
+            
             # Verify download
             final_size = local_path.stat().st_size
             if final_size == remote_size:
-                elapsed = time.time() - start_time
+                elapsed = time.monotonic() - start_time
                 avg_speed = (final_size - resume_pos) / elapsed / (1024**2)
                 logger.info(f"✅ Download complete! Average speed: {avg_speed:.1f}MB/s")
+                if hasher is not None:
+                    self.sha1_hex = hasher.hexdigest()
                 return True
             else:
                 logger.error(f"Size mismatch: got {final_size}, expected {remote_size}")
@@ -178,46 +391,201 @@ class FTPDownloader:
             logger.debug(f"Traceback: {traceback.format_exc()}")
             return False
 
+    
+    def download_file_parallel(self, remote_path: str, local_path: Path, n_streams: int = 4,
+                               chunk_size: Optional[int] = None) -> bool:
+        """
+        Download file over n_streams concurrent FTP connections.
+        Splits the remaining bytes into ranges; each worker logs in separately,
+        sends REST <start> + RETR and pwrites its range in place.
+        Ranges land out of order, so the file's size says nothing about what was
+        written: the transfer goes to '<name>.part' and is only renamed to
+        local_path once every range completed (or, on failure, after trimming it
+        to the contiguous prefix). A '.part' left behind by a killed run is discarded.
+        Falls back to the single-stream download_file if a worker fails
+        (e.g. the server rejects multiple logins).
+        """
+        if n_streams <= 1 or not hasattr(os, 'pwrite'):
+            return self.download_file(remote_path, local_path, chunk_size)
+        
+        local_path = Path(local_path)
+        local_path.parent.mkdir(parents=True, exist_ok=True)
+        
+        remote_size = self.get_file_size(remote_path)
+        if remote_size is None:
+            logger.error("Could not determine remote file size")
+            return False
+        
+        part_path = local_path.with_name(local_path.name + '.part')
+        if part_path.exists():
+            logger.warning(f"⚠️ Discarding interrupted segmented download {part_path.name}")
+            part_path.unlink()
+        
+        resume_pos = local_path.stat().st_size if local_path.exists() else 0
+        if resume_pos >= remote_size:
+            # Complete (or oversized) - let the single-stream path report it
+            return self.download_file(remote_path, local_path, chunk_size)
+        if resume_pos:
+            local_path.replace(part_path)  # Continue the verified prefix in the .part file
+        
+        segment_size = -(-(remote_size - resume_pos) // n_streams)
+        ranges = []
+        for i in range(n_streams):
+            start = resume_pos + i * segment_size
+            end = min(start + segment_size, remote_size)
+            if start < end:
+                ranges.append((start, end))
+        
+        logger.info(f"⚡ Segmented download: {len(ranges)} streams x {segment_size / (1024**2):.0f}MB "
+                    f"({(remote_size - resume_pos) / (1024**3):.2f}GB remaining)")
+        
+        done = [0] * len(ranges)
+        abort_event = threading.Event()
+        fd = _open_output(part_path, resume_pos, remote_size)
+        start_time = time.monotonic()
+        success = False
+        
+        try:
+            with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+                futures = [
+                    executor.submit(self._fetch_range, remote_path, fd, start, end,
+                                    index, done, abort_event, chunk_size)
+                    for index, (start, end) in enumerate(ranges)
+                ]
+                pending = set(futures)
+                while pending:
+                    _, pending = wait(pending, timeout=PARALLEL_LOG_INTERVAL)
+                    if pending and not abort_event.is_set():
+                        elapsed = time.monotonic() - start_time
+                        fetched = sum(done)
+                        speed_mbps = fetched / elapsed * _INV_MB if elapsed > 0 else 0
+                        progress_pct = ((resume_pos + fetched) / remote_size) * 100
+                        eta_seconds = (remote_size - resume_pos - fetched) * elapsed / max(1, fetched)
+                        logger.info(f"📥 {progress_pct:.1f}% - {(resume_pos + fetched) * _INV_GB:.2f}/{remote_size * _INV_GB:.2f}GB - {speed_mbps:.1f}MB/s - ETA {eta_seconds/60:.0f}m ({len(pending)} streams active)")
+                success = all(future.result() for future in futures)
+        finally:
+            # Only the first range is contiguous from resume_pos - on failure keep
+            # just that prefix so the next attempt can resume from it
+            os.ftruncate(fd, remote_size if success else resume_pos + done[0])
+            os.close(fd)
+            part_path.replace(local_path)
+        
+        if not success:
+            logger.warning("⚠️ Segmented download failed - falling back to single stream")
+            return self.download_file(remote_path, local_path, chunk_size)
+        
+        elapsed = time.monotonic() - start_time
+        avg_speed = (remote_size - resume_pos) / elapsed / (1024**2) if elapsed > 0 else 0
+        logger.info(f"✅ Download complete! Average speed: {avg_speed:.1f}MB/s ({len(ranges)} streams)")
+        return True
+    
+    def _fetch_range(self, remote_path: str, fd: int, start: int, end: int, index: int,
+                     done: List[int], abort_event: threading.Event, chunk_size: Optional[int]) -> bool:
+        """Fetch bytes [start, end) of remote_path on a dedicated connection."""
+        chunk_size = chunk_size or RECV_SIZE
+        worker = FTPDownloader(self.host, self.user, self.password, self.port, use_tls=self.use_tls)
+        try:
+            if not worker.connect():
+                abort_event.set()
+                return False
+            
+            worker.ftp.sock.settimeout(1800)
+            conn, _ = worker.ftp.ntransfercmd(f'RETR {to_wire(remote_path)}', rest=start)
+            offset = start
+            view = memoryview(bytearray(chunk_size))  # One buffer reused for the whole range
+            try:
+                while offset < end and not abort_event.is_set():
+                    # Fill the buffer (TLS returns one 16KB record per recv) then pwrite once
+                    want = min(chunk_size, end - offset)
+                    filled = 0
+                    while filled < want:
+                        n = conn.recv_into(view[filled:want])
+                        if not n:
+                            break
+                        filled += n
+                    if not filled:
+                        break
+                    _pwrite_all(fd, view[:filled], offset)
+                    offset += filled
+                    done[index] = offset - start
+                    if filled < want:
+                        break  # EOF
+            finally:
+                # Ranges other than the last stop mid-file - just drop the data connection
+                conn.close()
+            
+            if offset < end:
+                abort_event.set()
+                return False
+            return True
+            
+        except Exception as e:
+            logger.warning(f"Stream {index} failed: {e}")
+            abort_event.set()
+            return False
+        finally:
+            worker.disconnect()
 
 def download_with_retry(host: str, user: str, password: str, port: int,
                        remote_path: str, local_path: Path, 
-                       max_attempts: int = 5) -> bool:
-    """Download file with automatic retry and reconnection."""
+                       max_attempts: int = 5, n_streams: int = 1,
+                       session: Optional[FTPDownloader] = None, sha1: bool = False):
+    """
+    Download file with automatic retry and reconnection.
+    n_streams > 1 fetches byte ranges over parallel connections.
+    If session (e.g. an FTPSession) is given it is reused and left open; it is
+    only reconnected when its control connection has dropped.
+    With sha1=True the file is hashed in-flight and the digest is left in the
+    downloader's sha1_hex (read it from session; None if it couldn't be computed).
+    Only single-stream downloads are hashed: segments arrive out of order, so
+    n_streams > 1 leaves hashing to the consumer.
+    Returns True on success, False once every attempt failed.
+    """
     
     for attempt in range(1, max_attempts + 1):
         logger.info(f"📥 Download attempt {attempt}/{max_attempts}")
         
-        downloader = FTPDownloader(host, user, password, port, use_tls=True)
+        own_session = session is None
+        downloader = FTPDownloader(host, user, password, port, use_tls=True) if own_session else session
         
         try:
-            if not downloader.connect():
+            connected = downloader.connect() if own_session or downloader.ftp is None else True
+            if not connected:
                 logger.error("Failed to connect to FTP server")
                 downloader.disconnect()
                 if attempt < max_attempts:
-                    wait_time = 30 * attempt
-                    logger.info(f"⏳ Waiting {wait_time}s before retry...")
+                    wait_time = backoff_delay(30, attempt)
+                    logger.info(f"⏳ Waiting {wait_time:.0f}s before retry...")
                     time.sleep(wait_time)
                 continue
             
-            success = downloader.download_file(remote_path, local_path, chunk_size=4*1024*1024)  # 4MB chunks for faster transfers
-            downloader.disconnect()
+            if n_streams > 1:
+                # Not hashed - clear any digest a shared session kept from its previous file
+                downloader.sha1_hex = None
+                success = downloader.download_file_parallel(remote_path, local_path, n_streams=n_streams)
+            else:
+                success = downloader.download_file(remote_path, local_path, sha1=sha1)
+            if own_session:
+                downloader.disconnect()
+            elif not success and not downloader.is_alive():
+                # Shared session died mid-transfer - the next attempt logs in again
+                downloader.disconnect()
             
             if success:
                 return True
             
             if attempt < max_attempts:
-                wait_time = 30 * attempt
-                logger.info(f"⏳ Waiting {wait_time}s before retry...")
+                wait_time = backoff_delay(30, attempt)
+                logger.info(f"⏳ Waiting {wait_time:.0f}s before retry...")
                 time.sleep(wait_time)
                 
         except Exception as e:
             logger.error(f"Attempt {attempt} failed: {e}")
             downloader.disconnect()
             if attempt < max_attempts:
-                wait_time = 30 * attempt
-                logger.info(f"⏳ Waiting {wait_time}s before retry...")
+                wait_time = backoff_delay(30, attempt)
+                logger.info(f"⏳ Waiting {wait_time:.0f}s before retry...")
                 time.sleep(wait_time)
     
     logger.error(f"❌ All {max_attempts} attempts failed")
     return False
-
@@ -8,260 +8,369 @@ import ftplib
 import socket
 import logging
 import time
-from typing import List, Dict, Optional
+from typing import Dict, Iterator, List, Optional, Tuple
 from datetime import datetime
 import re
 
+from ftp_connection import FTPConnection, FS_ENCODING, backoff_delay, from_wire, to_wire
+
 logger = logging.getLogger(__name__)
 
+# Unix-style LIST line: type, size and name out of
+# "drwxr-xr-x 2 user group size month day time name"
+_LIST_RE = re.compile(
+    rb'^([d-])\S*[ \t]+\d+[ \t]+\S+[ \t]+\S+[ \t]+(\d+)[ \t]+\S+[ \t]+\S+[ \t]+\S+[ \t]+([^\r\n]+)',
+    re.MULTILINE
+)
+
+
+class FileListing:
+    """
+    Files of one directory stored column-wise: parallel lists of names, sizes and paths.
+    Avoids building a dict per file; use as_dicts() for the old list-of-dicts shape.
+    """
+    __slots__ = ('names', 'sizes', 'paths')
+    
+    def __init__(self):
+        self.names: List[str] = []
+        self.sizes: List[int] = []
+        self.paths: List[str] = []
+    
+    def append(self, name: str, size: int, path: str):
+        self.names.append(name)
+        self.sizes.append(size)
+        self.paths.append(path)
+    
+    def __len__(self) -> int:
+        return len(self.names)
+    
+    def size_gb(self, i: int) -> float:
+        return round(self.sizes[i] / (1024**3), 2)
+    
+    def size_mb(self, i: int) -> float:
+        return round(self.sizes[i] / (1024**2), 2)
+    
+    def as_dicts(self) -> List[Dict]:
+        """Return files as [{'name', 'path', 'size', 'size_gb', 'size_mb'}, ...]."""
+        return [
+            {
+                'name': self.names[i],
+                'path': self.paths[i],
+                'size': self.sizes[i],
+                'size_gb': self.size_gb(i),
+                'size_mb': self.size_mb(i)
+            }
+            for i in range(len(self.names))
+        ]
+
 
-class FTPLister:
+class FTPLister(FTPConnection):
+    connect_timeout = 300  # 5 minute timeout
+    binary_on_connect = False  # listings run in ASCII mode; SIZE switches when needed
+    
     def __init__(self, host: str, user: str, password: str, port: int = 21, use_tls: bool = True):
-        self.host = host
-        self.user = user
-        self.password = password
-        self.port = port
-        self.use_tls = use_tls
-        self.ftp = None
-        
-    def connect(self):
-        """Connect to FTP server with TLS."""
-        try:
-            if self.use_tls:
-                self.ftp = ftplib.FTP_TLS()
-            else:
-                self.ftp = ftplib.FTP()
-            
-            logger.info(f"Connecting to {self.host}:{self.port}...")
-            self.ftp.connect(self.host, self.port, timeout=300)  # 5 minute timeout
-            self.ftp.login(self.user, self.password)
-            
-            if self.use_tls:
-                self.ftp.prot_p()  # Enable encryption for data channel
-            
-            logger.info(f"✅ Connected to {self.host}")
-            return True
-            
-        except Exception as e:
-            logger.error(f"Failed to connect: {e}")
-            return False
+        super().__init__(host, user, password, port, use_tls)
+        self._pipelining = None  # Whether the server answers pipelined commands (probed lazily)
     
-    def disconnect(self):
-        """Safely disconnect from FTP server."""
-        if self.ftp:
+    def _supports_pipelining(self) -> bool:
+        """
+        Probe once whether the server answers back-to-back commands in order.
+        Sends two NOOPs in a single write and expects two 2xx replies.
+        """
+        if self._pipelining is None:
             try:
-                self.ftp.quit()
-            except:
-                try:
-                    self.ftp.close()
-                except:
-                    pass
-            self.ftp = None
+                self.ftp.sock.sendall(b'NOOP\r\nNOOP\r\n')
+                replies = [self.ftp.getmultiline() for _ in range(2)]
+                self._pipelining = all(reply.startswith('2') for reply in replies)
+            except Exception as e:
+                logger.warning(f"Pipelining probe failed, reconnecting: {e}")
+                self._pipelining = False
+                # A NOOP reply may still be in flight - don't let the next command read it
+                self.reconnect()
+            logger.debug(f"Server pipelining support: {self._pipelining}")
+        return self._pipelining
     
-    def list_directories(self, path: str = "") -> List[str]:
+    def _sizes_batch(self, names: List[str], batch: int = 32) -> Dict[str, int]:
         """
-        List directories in a path.
-        Returns list of directory names.
+        Get sizes for many files in the current directory.
+        Writes up to `batch` SIZE commands at once and reads the replies in order,
+        so a directory costs one round-trip per batch instead of one per file.
         """
+        sizes = {}
+        names = [n for n in names if '\r' not in n and '\n' not in n]
+        if not names:
+            return sizes
+        
+        self._ensure_binary()  # SIZE requires binary mode
+        
+        if not self._supports_pipelining():
+            for name in names:
+                try:
+                    sizes[name] = self.ftp.size(to_wire(name))
+                except ftplib.all_errors:
+                    pass
+            return sizes
+        
+        for i in range(0, len(names), batch):
+            chunk = names[i:i + batch]
+            self.ftp.sock.sendall(''.join(f'SIZE {to_wire(n)}\r\n' for n in chunk).encode(self.ftp.encoding))
+            # Read every reply (errors included) to keep the control channel in sync
+            for name in chunk:
+                resp = self.ftp.getmultiline()
+                if resp.startswith('213'):
+                    try:
+                        sizes[name] = int(resp[3:].strip())
+                    except ValueError:
+                        pass
+        return sizes
+    
+    def _fill_missing_sizes(self, files: FileListing):
+        """Look up sizes the listing didn't provide (reported as 0) in one batch."""
+        missing = [i for i, size in enumerate(files.sizes) if size == 0]
+        if not missing:
+            return
         try:
-            dirs = []
-            # Try to change to the directory first
-            original_cwd = self.ftp.pwd()
-            if path:
-                self.ftp.cwd(path)
-            
-            # List entries using MLSD (machine-readable listing)
-            try:
-                for name, facts in self.ftp.mlsd():
-                    if name in ['.', '..']:
-                        continue
-                    if facts.get('type') == 'dir':
-                        dirs.append(name)
-                        logger.debug(f"  Found directory: {name}")
-            except ftplib.error_perm:
-                # MLSD not supported, fall back to NLST
-                logger.debug("MLSD not supported, using LIST fallback")
-                
-                # Get all entries
-                entries = []
-                self.ftp.retrlines('LIST', entries.append)
-                
-                for entry in entries:
-                    # Parse Unix-style directory listing
-                    # Format: drwxr-xr-x 2 user group size date time name
-                    if entry.startswith('d'):  # Directory
-                        parts = entry.split(None, 8)
-                        if len(parts) >= 9:
-                            name = parts[8]
-                            if name not in ['.', '..']:
-                                dirs.append(name)
-                                logger.debug(f"  Found directory: {name}")
-            
-            # Return to original directory
-            if path:
-                self.ftp.cwd(original_cwd)
-            
-            return dirs
-                
-        except ftplib.error_perm as e:
-            logger.warning(f"Permission error listing {path}: {e}")
-            return []
+            sizes = self._sizes_batch([files.names[i] for i in missing])
         except Exception as e:
-            logger.warning(f"Error listing directories in {path}: {e}")
-            return []
+            # Replies to the rest of a pipelined batch may still be queued on the control
+            # connection, where the next command would read them as its own - start a fresh one
+            logger.warning(f"SIZE lookup failed, reconnecting: {e}")
+            self.reconnect()
+            return
+        for i in missing:
+            files.sizes[i] = sizes.get(files.names[i], 0)
     
-    def list_files(self, path: str = "") -> List[Dict]:
+    def _list_unix(self) -> List[Tuple[bool, int, str]]:
         """
-        List files in a directory (non-recursive).
-        Returns list of dicts with file info.
+        LIST the current directory and parse it in one regex pass over the raw bytes.
+        Returns (is_dir, size, name) tuples; only names get decoded.
+        """
+        chunks = []
+        self.ftp.retrbinary('LIST', chunks.append)
+        self._binary = True  # retrbinary leaves the session in TYPE I
+        
+        entries = []
+        for match in _LIST_RE.finditer(b''.join(chunks)):
+            name = match.group(3).decode(FS_ENCODING, 'surrogateescape')
+            if name not in ('.', '..'):
+                entries.append((match.group(1) == b'd', int(match.group(2)), name))
+        return entries
+    
+    def list_entries(self, path: str = "", sizes: bool = True) -> Tuple[FileListing, List[str]]:
+        """
+        List files and subdirectories of a path (non-recursive) from a single
+        MLSD (or LIST) call. Sizes the listing didn't provide are looked up
+        unless sizes=False.
+        Returns (FileListing, directory names); both empty on error.
         """
         try:
+            files = FileListing()
+            dirs = []
+            prefix = f"{path}/" if path else ""  # Joined onto every file name below
+            # MLSD goes through retrlines, which switches the session to TYPE A
+            self._binary = False
             # Try to change to the directory first
             original_cwd = self.ftp.pwd()
             if path:
                 try:
-                    self.ftp.cwd(path)
+                    self.ftp.cwd(to_wire(path))
                 except ftplib.error_perm as e:
                     logger.warning(f"Cannot access directory {path}: {e}")
-                    return []
-            
-            files = []
+                    return files, dirs
             
             # Try MLSD first (more reliable and structured)
             try:
                 for name, facts in self.ftp.mlsd():
                     if name in ['.', '..']:
                         continue
-                    if facts.get('type') in ['file', None]:  # None means regular file
+                    name = from_wire(name)
+                    entry_type = facts.get('type')
+                    if entry_type == 'dir':
+                        dirs.append(name)
+                        logger.debug(f"  Found directory: {name}")
+                    elif entry_type in ['file', None]:  # None means regular file
                         try:
-                            # Get size from facts or use SIZE command
+                            # Get size from facts - missing sizes are fetched in one batch below
                             size = int(facts.get('size', 0))
-                            if size == 0:
-                                # Try SIZE command (requires binary mode)
-                                try:
-                                    self.ftp.voidcmd('TYPE I')  # Set binary mode for accurate size
-                                    size = self.ftp.size(name)
-                                except:
-                                    pass
-                            
-                            full_path = f"{path}/{name}" if path else name
-                            
-                            files.append({
-                                'name': name,
-                                'path': full_path,
-                                'size': size,
-                                'size_gb': round(size / (1024**3), 2),
-                                'size_mb': round(size / (1024**2), 2)
-                            })
+                            files.append(name, size, prefix + name)
                         except Exception as e:
                             logger.debug(f"Error processing file {name}: {e}")
                             
             except ftplib.error_perm:
                 # MLSD not supported, fall back to LIST
-                logger.debug("MLSD not supported for files, using LIST fallback")
-                
-                entries = []
-                self.ftp.retrlines('LIST', entries.append)
+                logger.debug("MLSD not supported, using LIST fallback")
                 
-                for entry in entries:
-                    # Parse Unix-style file listing
-                    # Format: -rw-r--r-- 1 user group size date time name
-                    if entry.startswith('-'):  # Regular file
-                        parts = entry.split(None, 8)
-                        if len(parts) >= 9:
-                            name = parts[8]
-                            try:
-                                size = int(parts[4])
-                            except:
-                                # Try SIZE command (requires binary mode)
-                                try:
-                                    self.ftp.voidcmd('TYPE I')  # Set binary mode for accurate size
-                                    size = self.ftp.size(name)
-                                except:
-                                    size = 0
-                            
-                            full_path = f"{path}/{name}" if path else name
-                            
-                            files.append({
-                                'name': name,
-                                'path': full_path,
-                                'size': size,
-                                'size_gb': round(size / (1024**3), 2),
-                                'size_mb': round(size / (1024**2), 2)
-                            })
+                for is_dir, size, name in self._list_unix():
+                    if is_dir:
+                        dirs.append(name)
+                        logger.debug(f"  Found directory: {name}")
+                    else:
+                        files.append(name, size, prefix + name)
+            
+            if sizes:
+                self._fill_missing_sizes(files)
             
             # Return to original directory
             if path:
                 self.ftp.cwd(original_cwd)
             
-            return files
+            return files, dirs
             
         except Exception as e:
-            logger.warning(f"Error listing files in {path}: {e}")
-            return []
+            logger.warning(f"Error listing {path}: {e}")
+            return FileListing(), []
+    
+    def list_directories(self, path: str = "") -> List[str]:
+        """
+        List directories in a path.
+        Returns list of directory names.
+        """
+        return self.list_entries(path, sizes=False)[1]
+    
+    def list_files(self, path: str = "") -> FileListing:
+        """
+        List files in a directory (non-recursive).
+        Returns a FileListing (names/sizes/paths).
+        """
+        return self.list_entries(path)[0]
+    
+    def iter_files(self, path: str = "") -> Iterator[Tuple[str, int, str]]:
+        """Yield (name, size, full_path) for the files in path (non-recursive)."""
+        files = self.list_files(path)
+        yield from zip(files.names, files.sizes, files.paths)
+    
+    def walk_files(self, path: str = "") -> Iterator[Tuple[str, int, str]]:
+        """
+        Yield (name, size, full_path) for every file under path, depth-first.
+        Each directory's files are yielded as soon as it is listed and the control
+        connection is idle between items, so the caller can download on this same
+        session while the rest of the tree is still undiscovered.
+        """
+        stack = [path]
+        while stack:
+            path = stack.pop()
+            # One listing gives both the files and the subdirectories to descend into
+            files, dirs = self.list_entries(path)
+            yield from zip(files.names, files.sizes, files.paths)
+            # Reversed so the first subdirectory is popped (and walked) first
+            stack.extend(f"{path}/{name}" if path else name for name in reversed(dirs))
 
 
 def list_directories_with_retry(host: str, user: str, password: str, port: int,
-                                 path: str = "", max_attempts: int = 3) -> List[str]:
-    """List directories with automatic retry and reconnection."""
+                                 path: str = "", max_attempts: int = 3,
+                                 session: Optional[FTPLister] = None) -> List[str]:
+    """
+    List directories with automatic retry and reconnection.
+    Reuses session (left open) instead of logging in again if one is given.
+    """
     
     for attempt in range(1, max_attempts + 1):
-        lister = FTPLister(host, user, password, port, use_tls=True)
+        own_session = session is None
+        lister = FTPLister(host, user, password, port, use_tls=True) if own_session else session
         
         try:
-            if not lister.connect():
+            if (own_session or lister.ftp is None) and not lister.connect():
                 logger.error("Failed to connect to FTP server")
                 lister.disconnect()
                 if attempt < max_attempts:
-                    wait_time = 10 * attempt
-                    logger.info(f"⏳ Waiting {wait_time}s before retry...")
+                    wait_time = backoff_delay(10, attempt)
+                    logger.info(f"⏳ Waiting {wait_time:.0f}s before retry...")
                     time.sleep(wait_time)
                 continue
             
             dirs = lister.list_directories(path)
-            lister.disconnect()
+            if own_session:
+                lister.disconnect()
             return dirs
             
         except Exception as e:
             logger.error(f"Attempt {attempt} failed: {e}")
             lister.disconnect()
             if attempt < max_attempts:
-                wait_time = 10 * attempt
-                logger.info(f"⏳ Waiting {wait_time}s before retry...")
+                wait_time = backoff_delay(10, attempt)
+                logger.info(f"⏳ Waiting {wait_time:.0f}s before retry...")
                 time.sleep(wait_time)
     
     logger.error(f"❌ All {max_attempts} attempts failed to list directories in {path}")
     return []
 
 
+def list_entries_with_retry(host: str, user: str, password: str, port: int,
+                            path: str = "", max_attempts: int = 3,
+                            session: Optional[FTPLister] = None) -> Tuple[FileListing, List[str]]:
+    """
+    List files and directories of a path in one call, with automatic retry and reconnection.
+    Reuses session (left open) instead of logging in again if one is given.
+    """
+    
+    for attempt in range(1, max_attempts + 1):
+        own_session = session is None
+        lister = FTPLister(host, user, password, port, use_tls=True) if own_session else session
+        
+        try:
+            if (own_session or lister.ftp is None) and not lister.connect():
+                logger.error("Failed to connect to FTP server")
+                lister.disconnect()
+                if attempt < max_attempts:
+                    wait_time = backoff_delay(10, attempt)
+                    logger.info(f"⏳ Waiting {wait_time:.0f}s before retry...")
+                    time.sleep(wait_time)
+                continue
+            
+            files, dirs = lister.list_entries(path)
+            # list_entries swallows errors - an empty result may mean a dead connection
+            if not len(files) and not dirs and not lister.is_alive():
+                raise ConnectionError("FTP connection lost")
+            if own_session:
+                lister.disconnect()
+            return files, dirs
+            
+        except Exception as e:
+            logger.error(f"Attempt {attempt} failed: {e}")
+            lister.disconnect()
+            if attempt < max_attempts:
+                wait_time = backoff_delay(10, attempt)
+                logger.info(f"⏳ Waiting {wait_time:.0f}s before retry...")
+                time.sleep(wait_time)
+    
+    logger.error(f"❌ All {max_attempts} attempts failed to list {path}")
+    return FileListing(), []
+
+
 def list_files_with_retry(host: str, user: str, password: str, port: int,
-                          path: str = "", max_attempts: int = 3) -> List[Dict]:
-    """List files with automatic retry and reconnection."""
+                          path: str = "", max_attempts: int = 3,
+                          session: Optional[FTPLister] = None) -> FileListing:
+    """
+    List files with automatic retry and reconnection.
+    Reuses session (left open) instead of logging in again if one is given.
+    """
     
     for attempt in range(1, max_attempts + 1):
-        lister = FTPLister(host, user, password, port, use_tls=True)
+        own_session = session is None
+        lister = FTPLister(host, user, password, port, use_tls=True) if own_session else session
         
         try:
-            if not lister.connect():
+            if (own_session or lister.ftp is None) and not lister.connect():
                 logger.error("Failed to connect to FTP server")
                 lister.disconnect()
                 if attempt < max_attempts:
-                    wait_time = 10 * attempt
-                    logger.info(f"⏳ Waiting {wait_time}s before retry...")
+                    wait_time = backoff_delay(10, attempt)
+                    logger.info(f"⏳ Waiting {wait_time:.0f}s before retry...")
                     time.sleep(wait_time)
                 continue
             
             files = lister.list_files(path)
-            lister.disconnect()
+            if own_session:
+                lister.disconnect()
             return files
             
         except Exception as e:
             logger.error(f"Attempt {attempt} failed: {e}")
             lister.disconnect()
             if attempt < max_attempts:
-                wait_time = 10 * attempt
-                logger.info(f"⏳ Waiting {wait_time}s before retry...")
+                wait_time = backoff_delay(10, attempt)
+                logger.info(f"⏳ Waiting {wait_time:.0f}s before retry...")
                 time.sleep(wait_time)
     
     logger.error(f"❌ All {max_attempts} attempts failed to list files in {path}")
-    return []
+    return FileListing()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Persistent FTP session for listing and downloading many files.
+Logs in once and reuses the control connection across operations instead of
+paying TCP + TLS + login round-trips for every call.
+
+    with FTPSession(host, user, password, port) as session:
+        for f in session.list_files("Movies").as_dicts():
+            session.download(f['path'], Path("downloads") / f['name'])
+"""
+
+import logging
+from pathlib import Path
+from typing import List, Tuple
+
+from ftp_connection import TRANSIENT_ERRORS
+from ftp_downloader import FTPDownloader, download_with_retry
+from ftp_lister import FTPLister, FileListing
+
+logger = logging.getLogger(__name__)
+
+
+class FTPSession(FTPLister, FTPDownloader):
+    """One authenticated connection shared by listing and downloads."""
+    connect_timeout = FTPDownloader.connect_timeout
+    binary_on_connect = True
+
+    def _reconnect_if_dropped(self) -> bool:
+        """Reconnect only when the control connection is actually gone."""
+        if self.is_alive():
+            return False
+        logger.warning("⚠️ FTP session dropped - reconnecting")
+        self._pipelining = None
+        return self.reconnect()
+
+    def _call(self, op, *args, **kwargs):
+        """Run op, reconnecting once if the connection dropped underneath it."""
+        try:
+            return op(*args, **kwargs)
+        except TRANSIENT_ERRORS as e:
+            logger.warning(f"Transient FTP error: {e}")
+            if not self.reconnect():
+                raise
+            return op(*args, **kwargs)
+
+    def list_entries(self, path: str = "", sizes: bool = True) -> Tuple[FileListing, List[str]]:
+        """List files and subdirectories of path (non-recursive)."""
+        files, dirs = self._call(super().list_entries, path, sizes)
+        # list_entries swallows errors - an empty result may mean a dead connection
+        if not len(files) and not dirs and self._reconnect_if_dropped():
+            files, dirs = super().list_entries(path, sizes)
+        return files, dirs
+
+    def list_dir(self, path: str = "") -> List[str]:
+        """List directory names in path."""
+        return self.list_directories(path)
+
+    def download(self, remote_path: str, local_path: Path, n_streams: int = 1,
+                 max_attempts: int = 5) -> bool:
+        """Download remote_path over this session, retrying on failure."""
+        return download_with_retry(self.host, self.user, self.password, self.port,
+                                   remote_path, local_path, max_attempts=max_attempts,
+                                   n_streams=n_streams, session=self)
@@ -3,17 +3,27 @@
 Stream large 3D movie files from FTP server to Google Photos.
 Uses rclone to access FTP and gpmc to upload to Google Photos.
 Designed to work within GitHub Actions storage constraints.
+
+Disk footprint: gpmc uploads from a regular file, so every file lands in the
+temp directory. At most two are there at once (one uploading, one downloading);
+the next download waits for the upload when the disk can't hold both.
 """
 
 import os
 import sys
+import asyncio
+import functools
 import subprocess
 import json
 import logging
+import logging.handlers
+import re
+import threading
 import tempfile
 import shutil
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import Iterable, List, Dict, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
 import time
 import requests
 
@@ -30,7 +40,9 @@ except ImportError:
     sys.exit(1)
 
 try:
+    from ftp_connection import backoff_delay
     from ftp_downloader import download_with_retry
+    from ftp_session import FTPSession
 except ImportError:
     print("ERROR: ftp_downloader.py not found")
     sys.exit(1)
@@ -47,7 +59,8 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     handlers=[
         logging.StreamHandler(sys.stdout),
-        logging.FileHandler('ftp_to_gphotos.log')
+        # Capped at 4 x 10MB so a long run can't fill the runner's disk with logs
+        logging.handlers.RotatingFileHandler('ftp_to_gphotos.log', maxBytes=10 * 1024 * 1024, backupCount=3)
     ]
 )
 logger = logging.getLogger(__name__)
@@ -67,18 +80,33 @@ MIN_FILE_SIZE = 1 * 1024 * 1024 * 1024  # 1GB minimum (to avoid tiny files)
 MAX_FILE_SIZE = 50 * 1024 * 1024 * 1024  # 50GB maximum (with maximize-build-space we get ~60GB!)
 # Supported extensions - ISO files will be converted to MKV automatically
 SUPPORTED_EXTENSIONS = ['.mkv', '.iso', '.mp4', '.m4v', '.avi', '.m2ts']
-CHUNK_SIZE = 64 * 1024 * 1024  # 64MB chunks for streaming
 MAX_RETRIES = 3
 RETRY_DELAY = 60  # seconds
-RCLONE_TIMEOUT = 600  # 10 minutes timeout for operations
+DISK_HEADROOM_GB = 2  # Free space required on top of the file being downloaded
+# Characters dropped from local file names (\w is exactly str.isalnum() plus '_')
+_UNSAFE_FILENAME_CHARS = re.compile(r'[^\w. -]')
+LSJSON_TIMEOUT = 1800  # 30 minutes for the one-shot recursive listing of the whole tree
+LISTING_CONCURRENCY = 8  # rclone listings run at once when walking directory by directory
+# Directories the one-shot recursive lsjson lists in parallel (FTP has no ListR, so rclone walks the tree)
+RCLONE_CHECKERS = int(os.environ.get("RCLONE_CHECKERS", "8"))
+# Parallel FTP connections per download. 1 (default) downloads over the shared session and
+# hashes in flight; more is opt-in: every stream is an extra login against the server's per-IP limit
+FTP_STREAMS = int(os.environ.get("FTP_STREAMS", "1"))
+# Optional CPU pinning (e.g. "0-3" and "4-7") keeping the download and upload sides on separate
+# cores/chiplets; empty = no pinning. Download threads and the processes they spawn inherit theirs
+DOWNLOAD_CPUSET = os.environ.get("DOWNLOAD_CPUSET", "")
+UPLOAD_CPUSET = os.environ.get("UPLOAD_CPUSET", "")
+GP_UPLOAD_THREADS = int(os.environ.get("GP_UPLOAD_THREADS", os.environ.get("GPMC_THREADS", "4")))  # gpmc upload threads
 
 
+@functools.lru_cache(maxsize=1)
 def check_rclone_installed() -> bool:
-    """Check if rclone is installed and accessible."""
+    """Check if rclone is installed and accessible. Runs `rclone version` once per process."""
     try:
-        result = subprocess.run(['rclone', 'version'], capture_output=True, text=True, timeout=10)
+        result = subprocess.run(['rclone', 'version'], capture_output=True, timeout=10)
         if result.returncode == 0:
-            logger.info(f"rclone version: {result.stdout.strip().split()[0]}")
+            version = result.stdout.splitlines()[0].decode(errors='replace') if result.stdout else '?'
+            logger.info(f"rclone version: {version}")
             return True
         return False
     except FileNotFoundError:
@@ -89,314 +117,366 @@ def check_rclone_installed() -> bool:
         return False
 
 
-def list_directories(remote: str, path: str = "") -> List[str]:
+async def run_rclone(cmd: List[str], timeout: float, sem: asyncio.Semaphore) -> tuple:
+    """
+    Run an rclone command without blocking the event loop.
+    At most LISTING_CONCURRENCY commands run at once (bounded by sem).
+    Returns (returncode, stdout, stderr): stdout stays bytes (json.loads takes them
+    directly), only the short stderr is decoded for logging.
     """
-    List directories in a path using rclone lsd.
+    async with sem:
+        proc = await asyncio.create_subprocess_exec(
+            *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+        try:
+            stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            raise
+        return proc.returncode, stdout, stderr.decode(errors='replace')
+
+
+async def list_directory(remote: str, path: str, min_size: int, max_size: int, extensions: List[str],
+                         sem: asyncio.Semaphore) -> Tuple[List[Dict], List[str]]:
+    """
+    List the matching files and the subdirectories of one directory (non-recursive)
+    with a single rclone lsjson. The type/size filters only apply to files, so
+    subdirectories still come back.
     Note: 'remote' here is the server name (e.g. 'Challenger')
-    Returns list of directory names.
+    Returns (list of file dicts sorted by size (smallest first), list of directory names).
     """
     try:
+        # lsjson only lists this directory unless --recursive is given
         cmd = [
-            'rclone', 'lsd', f'{remote}:{path}',
-            '--timeout', '120s',
+            'rclone', 'lsjson', f'{remote}:{path}',
+            '--no-modtime',
+            '--no-mimetype',
+            '--timeout', '300s',
             '--contimeout', '60s',
             '--low-level-retries', '5',
             '--retries', '3'
-        ]
+        ] + rclone_filter_args(min_size, max_size, extensions)
         
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=180)
+        returncode, stdout, stderr = await run_rclone(cmd, 420, sem)
         
-        if result.returncode != 0:
-            logger.warning(f"Failed to list directories in {path}: {result.stderr[:200]}")
-            return []
+        if returncode != 0:
+            logger.warning(f"Failed to list {path}: {stderr[:200]}")
+            return [], []
         
+        extensions = frozenset(ext.lower() for ext in extensions)
+        files = []
         dirs = []
-        for line in result.stdout.strip().split('\n'):
-            if not line.strip():
+        for entry in json.loads(stdout or b'[]'):
+            file_name = entry.get('Name', '')
+            if entry.get('IsDir'):
+                dirs.append(file_name)
+                logger.debug("Found directory: %s", file_name)
                 continue
-            # lsd output format: size date time size name
-            # Example: "          -1 2025-10-31 10:33:09        -1 Challenger"
-            parts = line.split()
-            if len(parts) >= 5:
-                # Skip first 4 columns: size, date, time, size
-                dir_name = ' '.join(parts[4:])  # Handle names with spaces
-                dirs.append(dir_name)
-                logger.debug(f"Found directory: {dir_name}")
+            
+            # Check if it's a supported file type
+            if file_name[file_name.rfind('.'):].lower() not in extensions:
+                continue
+            
+            # Check size
+            file_size = entry.get('Size', -1)
+            if min_size <= file_size <= max_size:
+                full_path = f"{path}/{file_name}" if path else file_name
+                files.append({
+                    'path': full_path,
+                    'size': file_size,
+                    'size_gb': file_size / (1024**3)
+                })
+                logger.info("  Found: %s (%.2fGB)", file_name, files[-1]['size_gb'])
         
-        return dirs
+        # Sort by size (smallest first) - more likely to complete on unstable FTP
+        files.sort(key=lambda x: x['size'])
+        if files:
+            logger.info(f"  📊 Sorted {len(files)} files by size (smallest first)")
+        
+        return files, dirs
         
     except Exception as e:
-        logger.warning(f"Error listing directories in {path}: {e}")
-        return []
+        logger.warning(f"Error listing {path}: {e}")
+        return [], []
+
 
+def rclone_filter_args(min_size: int, max_size: int, extensions: List[str]) -> List[str]:
+    """rclone filter flags so listings only return files of the wanted types and sizes."""
+    args = ['--min-size', f'{min_size}B', '--max-size', f'{max_size}B', '--ignore-case']
+    for ext in extensions:
+        args += ['--include', f'*{ext}']
+    return args
 
-def list_files_in_directory(remote: str, path: str, min_size: int, max_size: int, extensions: List[str]) -> List[Dict]:
+
+def list_all_files_recursive(remote: str, path: str, min_size: int, max_size: int,
+                             extensions: List[str]) -> Optional[List[Dict]]:
     """
-    List files in a specific directory (non-recursive) using rclone ls.
-    Returns list of dicts with file info, sorted by size (smallest first).
+    List every matching file under path with a single recursive rclone lsjson,
+    instead of one rclone lsd + ls per directory. rclone applies the type and
+    size filters itself, so only matching entries are returned.
+    Returns list of dicts with file info in depth-first directory order (smallest
+    first within a directory), or None if the listing failed.
     """
     try:
-        # Use --max-depth 1 to only list files in this directory
         cmd = [
-            'rclone', 'ls', f'{remote}:{path}',
-            '--max-depth', '1',
+            'rclone', 'lsjson', f'{remote}:{path}',
+            '--recursive',
+            '--files-only',
+            '--fast-list',
+            '--checkers', str(RCLONE_CHECKERS),
+            '--no-modtime',
+            '--no-mimetype',
             '--timeout', '300s',
             '--contimeout', '60s',
             '--low-level-retries', '5',
             '--retries', '3'
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=420)
-        
-        if result.returncode != 0:
-            logger.warning(f"Failed to list files in {path}: {result.stderr[:200]}")
-            return []
+        ] + rclone_filter_args(min_size, max_size, extensions)
         
+        extensions = frozenset(ext.lower() for ext in extensions)
         files = []
-        for line in result.stdout.strip().split('\n'):
-            if not line.strip():
-                continue
-            parts = line.split(None, 1)
-            if len(parts) == 2:
-                try:
-                    file_size = int(parts[0])
-                    file_name = parts[1]
-                    
-                    # Check if it's a supported file type
-                    if not any(file_name.lower().endswith(ext.lower()) for ext in extensions):
+        # rclone lsjson prints one entry per line between '[' and ']' - parse as it
+        # streams in rather than holding the whole tree's JSON in memory
+        with tempfile.TemporaryFile() as stderr:
+            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr)
+            timer = threading.Timer(LSJSON_TIMEOUT, process.kill)
+            timer.start()
+            try:
+                for line in process.stdout:
+                    line = line.strip().rstrip(b',')
+                    if not line or line in (b'[', b']'):
+                        continue
+                    entry = json.loads(line)
+                    file_size = entry.get('Size', -1)
+                    entry_path = entry.get('Path', '')
+                    if entry.get('IsDir') or entry_path[entry_path.rfind('.'):].lower() not in extensions:
                         continue
-                    
-                    # Check size
                     if min_size <= file_size <= max_size:
-                        full_path = os.path.join(path, file_name) if path else file_name
+                        full_path = f"{path}/{entry_path}" if path else entry_path
                         files.append({
                             'path': full_path,
                             'size': file_size,
                             'size_gb': file_size / (1024**3)
                         })
-                        logger.info(f"  Found: {file_name} ({file_size / (1024**3):.2f}GB)")
-                except ValueError:
-                    continue
-        
-        # Sort by size (smallest first) - more likely to complete on unstable FTP
-        files.sort(key=lambda x: x['size'])
-        if files:
-            logger.info(f"  📊 Sorted {len(files)} files by size (smallest first)")
+            except BaseException:
+                process.kill()
+                raise
+            finally:
+                process.stdout.close()
+                process.wait()
+                timer.cancel()
+            
+            if process.returncode != 0:
+                stderr.seek(0)
+                logger.warning(f"Recursive listing of {path or '(root)'} failed: "
+                               f"{stderr.read(200).decode(errors='replace')}")
+                return None
         
+        # Group by directory (parents before children), smallest first within each
+        files.sort(key=lambda f: (f['path'].rpartition('/')[0].split('/'), f['size']))
+        logger.info(f"📊 Found {len(files)} matching file(s) under {path or '(root)'} in one listing")
         return files
         
     except Exception as e:
-        logger.warning(f"Error listing files in {path}: {e}")
-        return []
+        logger.warning(f"Error listing {path or '(root)'} recursively: {e}")
+        return None
 
 
-def traverse_and_process_depth_first(remote: str, auth_data: str, temp_dir: Path, 
-                                     min_size: int, max_size: int, extensions: List[str],
-                                     state: StateManager,
-                                     path: str = "", depth: int = 0) -> tuple:
+async def walk_depth_first(remote: str, min_size: int, max_size: int, extensions: List[str],
+                           sem: asyncio.Semaphore, path: str = "", depth: int = 0) -> List[Dict]:
     """
-    Traverse directories depth-first and process files immediately.
-    Returns (successful_count, failed_count).
+    Walk directories with rclone lsjson, listing a directory's files and
+    subdirectories in one call and scanning every discovered directory as soon as
+    its parent is listed (no recursion - a set of pending scans is drained).
+    Returns files in depth-first order.
     """
-    indent = "  " * depth
-    display_path = path if path else '(root)'
-    logger.info(f"{indent}📁 Scanning: {display_path}")
+    listings = {}  # path -> (files, subdirectory paths)
+    
+    async def scan(dir_path: str, dir_depth: int):
+        indent = "  " * dir_depth
+        display_path = dir_path if dir_path else '(root)'
+        logger.info(f"{indent}📁 Scanning: {display_path}")
+        
+        files, subdirs = await list_directory(remote, dir_path, min_size, max_size, extensions, sem)
+        if files:
+            logger.info(f"{indent}✓ Found {len(files)} file(s) in {display_path}")
+        if subdirs:
+            logger.info(f"{indent}↳ Found {len(subdirs)} subdirectory(ies) in {display_path}: {', '.join(subdirs)}")
+        # Use forward slashes for paths (rclone standard)
+        children = [f"{dir_path}/{subdir}" if dir_path else subdir for subdir in subdirs]
+        listings[dir_path] = (files, children)
+        return children, dir_depth + 1
+    
+    pending = {asyncio.ensure_future(scan(path, depth))}
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            children, child_depth = task.result()
+            pending.update(asyncio.ensure_future(scan(child, child_depth)) for child in children)
     
+    # Reassemble in depth-first order with an explicit stack
+    ordered = []
+    stack = [path]
+    while stack:
+        files, children = listings[stack.pop()]
+        ordered.extend(files)
+        stack.extend(reversed(children))
+    return ordered
+
+
+def list_files_depth_first(remote: str, path: str, min_size: int, max_size: int,
+                           extensions: List[str], depth: int = 0) -> List[Dict]:
+    """Blocking wrapper around walk_depth_first."""
+    async def walk():
+        sem = asyncio.Semaphore(LISTING_CONCURRENCY)
+        return await walk_depth_first(remote, min_size, max_size, extensions, sem, path, depth)
+    return asyncio.run(walk())
+
+
+def pin_current_thread(cpuset: str) -> None:
+    """Restrict the calling thread to the CPUs in cpuset ("0-3,6"); no-op if empty or unsupported."""
+    if not cpuset or not hasattr(os, 'sched_setaffinity'):
+        return
+    try:
+        cpus = set()
+        for part in cpuset.split(','):
+            first, _, last = part.partition('-')
+            cpus.update(range(int(first), int(last or first) + 1))
+        os.sched_setaffinity(0, cpus)
+        logger.info(f"📌 {threading.current_thread().name} pinned to CPUs {cpuset}")
+    except (ValueError, OSError) as e:
+        logger.warning(f"Could not pin to CPUs {cpuset}: {e}")
+
+
+def process_files_pipelined(remote: str, files: Iterable[Dict], auth_data: str, temp_dir: Path,
+                            state: StateManager) -> tuple:
+    """
+    Download the next file while the previous one uploads.
+    Downloads run on this thread, uploads on a single worker thread; a finished
+    download waits for the previous upload before it is handed over, so at most
+    two files (one uploading, one downloading) are on disk at once. If the disk
+    can't hold both, the download waits for the upload instead.
+    All downloads share one FTP session, logged in on first use.
+    Returns (successful_count, failed_count).
+    """
     successful = 0
     failed = 0
+    pending_upload = None
+    server_info = FTP_SERVERS[CURRENT_SERVER]
+    session = FTPSession(server_info['host'], FTP_USER, FTP_PASS, server_info['port'], use_tls=True)
+    original_cpus = os.sched_getaffinity(0) if DOWNLOAD_CPUSET and hasattr(os, 'sched_getaffinity') else None
     
-    # Process files in current directory
-    files = list_files_in_directory(remote, path, min_size, max_size, extensions)
-    if files:
-        logger.info(f"{indent}✓ Found {len(files)} file(s) in this directory")
-        
-        # Filter out already completed files BEFORE processing
-        files_to_process = []
-        skipped_count = 0
-        
-        for file_info in files:
-            remote_path = file_info['path']
-            file_name = os.path.basename(remote_path)
-            
-            # Check if already completed - skip immediately
-            if state.is_completed(remote_path):
-                logger.info(f"{indent}⏭️  SKIPPING {file_name} - already uploaded (found in state)")
-                skipped_count += 1
-                continue
-            
-            files_to_process.append(file_info)
-        
-        if skipped_count > 0:
-            logger.info(f"{indent}📊 Skipped {skipped_count} already uploaded file(s)")
-        
-        # Process remaining files
-        for file_info in files_to_process:
-            if process_file(remote, file_info, auth_data, temp_dir, state):
-                successful += 1
-            else:
-                failed += 1
-    
-    # Get subdirectories
-    subdirs = list_directories(remote, path)
-    if subdirs:
-        logger.info(f"{indent}↳ Found {len(subdirs)} subdirectory(ies): {', '.join(subdirs)}")
-        for subdir in subdirs:
-            # Use forward slashes for paths (rclone standard)
-            if path:
-                subpath = f"{path}/{subdir}"
-            else:
-                subpath = subdir
+    def collect(future) -> None:
+        nonlocal successful, failed
+        if future.result():
+            successful += 1
+        else:
+            failed += 1
+    
+    try:
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix='upload',
+                                initializer=pin_current_thread, initargs=(UPLOAD_CPUSET,)) as uploader:
+            # The worker is only spawned on first submit and inherits this thread's CPUs -
+            # start it before pinning so an empty UPLOAD_CPUSET leaves it unpinned
+            uploader.submit(lambda: None).result()
+            pin_current_thread(DOWNLOAD_CPUSET)
+            for file_info in files:
+                remote_path = file_info['path']
+                if state.is_completed(remote_path, file_info['size']):
+                    logger.info(f"⏭️  Skipping {remote_path.rpartition('/')[2]} - already uploaded successfully (duplicate check)")
+                    successful += 1
+                    continue
+                
+                if pending_upload is not None:
+                    free_gb = shutil.disk_usage(temp_dir).free / (1024**3)
+                    if free_gb < file_info['size_gb'] + DISK_HEADROOM_GB:
+                        # Not enough room for both files - let the upload finish and free its file first
+                        logger.info(f"⏳ {free_gb:.1f}GB free - waiting for the current upload before downloading")
+                        collect(pending_upload)
+                        pending_upload = None
+                
+                local_path = fetch_file(remote, file_info, temp_dir, state, session=session)
+                
+                if pending_upload is not None:
+                    collect(pending_upload)
+                    pending_upload = None
+                
+                if local_path is None:
+                    failed += 1
+                    continue
+                
+                pending_upload = uploader.submit(upload_file, file_info, local_path, auth_data, state)
             
-            # Recursively process subdirectory
-            sub_success, sub_failed = traverse_and_process_depth_first(
-                remote, auth_data, temp_dir, min_size, max_size, extensions, 
-                state, subpath, depth + 1
-            )
-            successful += sub_success
-            failed += sub_failed
+            if pending_upload is not None:
+                collect(pending_upload)
+    finally:
+        session.disconnect()
+        if original_cpus is not None:
+            os.sched_setaffinity(0, original_cpus)
     
     return successful, failed
 
 
-def stream_file_from_ftp(remote: str, remote_path: str, local_path: Path, chunk_size: int = CHUNK_SIZE, attempt: int = 1) -> bool:
+def traverse_and_process_depth_first(remote: str, auth_data: str, temp_dir: Path, 
+                                     min_size: int, max_size: int, extensions: List[str],
+                                     state: StateManager,
+                                     path: str = "", depth: int = 0) -> tuple:
     """
-    Stream a file from FTP to local path using rclone copy.
-    Optimized for streaming servers - uses large buffers and no timeouts.
-    Returns True if successful, False otherwise.
+    Process every file under path depth-first, overlapping each upload with the
+    next download. Lists the whole tree with one rclone call, falling back to
+    walking it directory by directory if that fails.
+    Returns (successful_count, failed_count).
     """
-    logger.info(f"🎬 Streaming {remote_path} to {local_path}... (attempt {attempt})")
+    files = list_all_files_recursive(remote, path, min_size, max_size, extensions)
+    if files is None:
+        logger.warning("⚠️ Falling back to per-directory listing")
+        files = list_files_depth_first(remote, path, min_size, max_size, extensions, depth)
     
-    # Ensure parent directory exists
-    local_path.parent.mkdir(parents=True, exist_ok=True)
+    # Filter out already completed files BEFORE processing
+    pending = [f for f in files if not state.is_completed(f['path'], f['size'])]
+    if len(pending) < len(files):
+        logger.info(f"📊 Skipped {len(files) - len(pending)} already uploaded file(s)")
     
-    # Keep partial file for resume - FTP supports REST command
-    if local_path.exists():
-        partial_size = local_path.stat().st_size
-        logger.info(f"🔄 Found partial download: {partial_size / (1024**3):.2f}GB - will resume!")
-        # rclone will automatically skip if file complete, resume if partial
-    
-    process = None
+    # The same file reachable under two paths (symlinks, aliases) is only processed once.
+    # Name and size can also match two distinct files in different folders, so every skip
+    # is logged with the path it matched and recorded in state, where it can be undone
+    seen = state.get_completed_keys()
+    unique = []
+    for f in pending:
+        key = (f['path'].rpartition('/')[2].lower(), f['size'])
+        original = seen.get(key)
+        if original is not None:
+            logger.info(f"⏭️  Skipping {f['path']} - same name and size as {original}")
+            state.mark_skipped(f['path'], f"duplicate of {original}")
+            continue
+        seen[key] = f['path']
+        unique.append(f)
+    if len(unique) < len(pending):
+        logger.info(f"📊 Skipped {len(pending) - len(unique)} duplicate file(s) (same name and size)")
+    pending = unique
+    return process_files_pipelined(remote, pending, auth_data, temp_dir, state)
+
+
+def _file_size(path: Path) -> Optional[int]:
+    """Size of path from a single stat(), or None if it doesn't exist."""
     try:
-        # Use rclone copy with progress reporting and optimized settings
-        # Copy to parent directory - rclone will preserve filename
-        remote_dir = os.path.dirname(remote_path).strip('/')
-        remote_filename = os.path.basename(remote_path)
-        
-        # Streaming-optimized settings for fast FTP server
-        cmd = [
-            'rclone', 'copy',
-            f'{remote}:{remote_path}',
-            str(local_path.parent),
-            '--progress',
-            '--buffer-size', '256M',  # LARGE buffer for streaming
-            '--transfers', '1',
-            '--checkers', '1',
-            '--low-level-retries', '10',
-            '--retries', '5',
-            '--stats', '30s',
-            '--log-level', 'INFO',
-            '--timeout', '0',  # NO timeout - let it stream!
-            '--contimeout', '300s',  # 5 minutes for initial connection
-            '--no-traverse',  # Don't list, just copy
-            '--no-check-dest',  # Don't verify before copy
-            '--streaming-upload-cutoff', '0',  # Stream everything
-            '--use-mmap',  # Use memory mapping for efficiency
-        ]
-        
-        logger.info(f"Starting download: {' '.join(cmd)}")
-        start_time = time.time()
-        last_progress_time = start_time
-        last_transferred_gb = 0.0
-        stall_start_time = None
-        MAX_STALL_TIME = 300  # 5 minutes - allow for streaming variations
-        
-        # Run with real-time output
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            bufsize=1
-        )
-        
-        # Stream output with stall detection
-        for line in process.stdout:
-            line = line.strip()
-            if line:
-                current_time = time.time()
-                
-                # Extract current transferred amount to detect stalls
-                if 'Transferred:' in line and 'GiB' in line:
-                    try:
-                        # Parse "Transferred:   1.233 GiB / 7.098 GiB"
-                        parts = line.split('Transferred:')[1].strip()
-                        current_str = parts.split('GiB')[0].strip().split('/')[0].strip()
-                        current_gb = float(current_str)
-                        
-                        # Check if we're making progress
-                        if abs(current_gb - last_transferred_gb) < 0.01:  # Less than 10MB progress
-                            if stall_start_time is None:
-                                stall_start_time = current_time
-                                logger.warning(f"⚠️ Download stalled at {current_gb:.3f}GB")
-                            else:
-                                stall_duration = current_time - stall_start_time
-                                if stall_duration > MAX_STALL_TIME:
-                                    logger.error(f"💀 Download STUCK at {current_gb:.3f}GB for {stall_duration:.0f}s - KILLING")
-                                    process.kill()
-                                    time.sleep(1)
-                                    break
-                                elif stall_duration > 60:
-                                    logger.warning(f"⏳ Still stalled at {current_gb:.3f}GB ({stall_duration:.0f}s)")
-                        else:
-                            # Progress detected
-                            if stall_start_time is not None:
-                                logger.info(f"✓ Progress resumed from {last_transferred_gb:.3f}GB to {current_gb:.3f}GB")
-                            stall_start_time = None
-                            last_transferred_gb = current_gb
-                    except Exception as e:
-                        logger.debug(f"Failed to parse transfer amount: {e}")
-                
-                # Log progress every 30 seconds
-                if current_time - last_progress_time >= 30:
-                    logger.info(f"rclone progress: {line}")
-                    last_progress_time = current_time
-                elif 'ETA' in line or 'Transferred' in line or 'Errors' in line:
-                    logger.info(f"rclone: {line}")
-        
-        process.wait()
-        
-        elapsed = time.time() - start_time
-        
-        if process.returncode == 0:
-            if local_path.exists():
-                file_size = local_path.stat().st_size
-                speed = file_size / elapsed / (1024**2) if elapsed > 0 else 0
-                logger.info(f"Download completed: {file_size / (1024**3):.2f}GB in {elapsed:.1f}s ({speed:.2f}MB/s)")
-                return True
-            else:
-                logger.error(f"Download completed but file not found at {local_path}")
-                # Check if file exists with different name (case sensitivity)
-                parent_files = list(local_path.parent.glob('*'))
-                if parent_files:
-                    logger.info(f"Files in directory: {[f.name for f in parent_files]}")
-                return False
-        else:
-            logger.error(f"Download failed with return code {process.returncode}")
-            return False
-            
-    except subprocess.TimeoutExpired:
-        logger.error("Download timed out")
-        if process:
-            process.kill()
-        return False
-    except Exception as e:
-        logger.error(f"Error streaming file: {e}", exc_info=True)
-        if process:
-            try:
-                process.kill()
-            except:
-                pass
-        return False
+        return path.stat().st_size
+    except FileNotFoundError:
+        return None
+
+
+def _drop_page_cache(path: Path) -> None:
+    """Ask the kernel to evict path's cached pages (a no-op where posix_fadvise is unavailable)."""
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    try:
+        fd = os.open(str(path), os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+    except OSError as e:
+        logger.debug(f"Could not drop page cache for {path}: {e}")
 
 
 def get_album_name_from_path(remote_path: str) -> Optional[str]:
@@ -420,7 +500,7 @@ def get_album_name_from_path(remote_path: str) -> Optional[str]:
         Album name as folder path, or None if file is in root
     """
     # Get directory path (everything except the filename)
-    dir_path = os.path.dirname(remote_path)
+    dir_path = remote_path.rpartition('/')[0]
     
     # If empty or just "/", file is at root - no album
     if not dir_path or dir_path == "/":
@@ -432,7 +512,20 @@ def get_album_name_from_path(remote_path: str) -> Optional[str]:
     return album_name if album_name else None
 
 
-def upload_to_google_photos(file_path: Path, auth_data: str, album_name: str = None, album_key: str = None, retries: int = MAX_RETRIES) -> tuple:
+_gp_clients: Dict[str, 'Client'] = {}  # auth_data -> Client, reused across files and retries
+
+
+def get_gp_client(auth_data: str) -> 'Client':
+    """Return the gpmc Client for auth_data, creating it on first use."""
+    client = _gp_clients.get(auth_data)
+    if client is None:
+        client = _gp_clients[auth_data] = Client(auth_data=auth_data)
+        logger.info("✓ Client initialized successfully")
+    return client
+
+
+def upload_to_google_photos(file_path: Path, auth_data: str, album_name: str = None, album_key: str = None, retries: int = MAX_RETRIES,
+                            sha1_hash: str = None, threads: int = GP_UPLOAD_THREADS, file_size: int = None) -> tuple:
     """
     Upload a file to Google Photos using gpmc.
     
@@ -442,12 +535,17 @@ def upload_to_google_photos(file_path: Path, auth_data: str, album_name: str = N
         album_name: Optional album name to add file to (folder path like "Blockbuster Movies/Avatar (2009)")
         album_key: Optional existing album key to reuse (avoids creating duplicate albums)
         retries: Maximum number of retry attempts
+        sha1_hash: Optional SHA-1 hex digest computed during download (spares gpmc hashing the file again)
+        threads: Number of gpmc upload threads
+        file_size: Size of file_path in bytes if the caller already stat()ed it
     
     Returns:
         Tuple of (media_key, album_key) if successful, (None, None) otherwise.
         album_key is the key of the album the file was added to (same as input if provided, or newly created)
     """
-    file_size_gb = file_path.stat().st_size / (1024**3)
+    if file_size is None:
+        file_size = file_path.stat().st_size
+    file_size_gb = file_size / (1024**3)
     logger.info("=" * 80)
     logger.info(f"🚀 STARTING UPLOAD TO GOOGLE PHOTOS")
     logger.info(f"File: {file_path.name}")
@@ -457,26 +555,27 @@ def upload_to_google_photos(file_path: Path, auth_data: str, album_name: str = N
             logger.info(f"Album: {album_name} (reusing existing)")
         else:
             logger.info(f"Album: {album_name} (will create new)")
-    logger.info(f"Settings: UNLIMITED STORAGE (use_quota=False, saver=False)")
+    logger.info(f"Settings: UNLIMITED STORAGE (use_quota=False, saver=False), {threads} upload thread(s)")
     logger.info("=" * 80)
     
     for attempt in range(1, retries + 1):
         try:
             logger.info(f"📤 Upload attempt {attempt}/{retries} starting...")
             
-            # Create client with auth data
-            client = Client(auth_data=auth_data)
-            logger.info("✓ Client initialized successfully")
+            client = get_gp_client(auth_data)
             
             start_time = time.time()
             logger.info(f"⏰ Upload started at {time.strftime('%H:%M:%S')}")
             
             # Upload WITHOUT album first (to avoid creating duplicates)
+            # target must be a regular file: gpmc stats it, hashes it (unless sha1_hash
+            # is given) and then reads it again to send, so a FIFO/pipe can't be streamed in
             result = client.upload(
                 target=str(file_path),
+                sha1_hash=sha1_hash,  # None → gpmc hashes the file itself
                 album_name=None,  # ← Upload to main library first
                 show_progress=True,  # This will show progress in console
-                threads=1,
+                threads=threads,
                 force_upload=False,
                 use_quota=False,  # ← UNLIMITED STORAGE
                 saver=False  # ← ORIGINAL QUALITY
@@ -489,7 +588,7 @@ def upload_to_google_photos(file_path: Path, auth_data: str, album_name: str = N
             
             if result and str(file_path) in result:
                 media_key = result[str(file_path)]
-                speed = file_path.stat().st_size / elapsed / (1024**2) if elapsed > 0 else 0
+                speed = file_size / elapsed / (1024**2) if elapsed > 0 else 0
                 
                 logger.info("=" * 80)
                 logger.info(f"✅ UPLOAD SUCCESSFUL!")
@@ -543,12 +642,15 @@ def upload_to_google_photos(file_path: Path, auth_data: str, album_name: str = N
             else:
                 logger.error(f"❌ Upload returned unexpected result: {result}")
                 if attempt < retries:
-                    logger.info(f"⏳ Retrying in {RETRY_DELAY} seconds...")
-                    time.sleep(RETRY_DELAY)
+                    wait_time = backoff_delay(RETRY_DELAY, attempt)
+                    logger.info(f"⏳ Retrying in {wait_time:.0f} seconds...")
+                    time.sleep(wait_time)
                     continue
                 return None, None
                 
         except Exception as e:
+            # Start the next attempt from a fresh client in case this one is in a bad state
+            _gp_clients.pop(auth_data, None)
             logger.error(f"❌ Upload attempt {attempt} failed with exception:")
             logger.error(f"   Error: {str(e)}")
             logger.error(f"   Type: {type(e).__name__}")
@@ -556,8 +658,9 @@ def upload_to_google_photos(file_path: Path, auth_data: str, album_name: str = N
             logger.error(f"   Traceback: {traceback.format_exc()}")
             
             if attempt < retries:
-                logger.info(f"⏳ Retrying in {RETRY_DELAY} seconds...")
-                time.sleep(RETRY_DELAY)
+                wait_time = backoff_delay(RETRY_DELAY, attempt)
+                logger.info(f"⏳ Retrying in {wait_time:.0f} seconds...")
+                time.sleep(wait_time)
             else:
                 logger.error(f"💔 All {retries} upload attempts failed for {file_path.name}")
     
@@ -579,32 +682,31 @@ def upload_state_artifact(state_file: Path) -> bool:
     return False
 
 
-def process_file(remote: str, file_info: Dict, auth_data: str, temp_dir: Path, state: StateManager) -> bool:
+def fetch_file(remote: str, file_info: Dict, temp_dir: Path, state: StateManager,
+               session: Optional[FTPSession] = None) -> Optional[Path]:
     """
-    Process a single file: download from FTP and upload to Google Photos.
-    Uses state manager to track progress and enable resumption.
-    Returns True if successful, False otherwise.
+    Download stage of process_files_pipelined: download from FTP, convert ISO/M2TS to MKV
+    and verify the result. Reuses session's login if one is given.
+    Returns the local file ready for upload, or None on failure.
     """
     remote_path = file_info['path']
-    file_name = os.path.basename(remote_path)
+    file_name = remote_path.rpartition('/')[2]
+    # Conversion below overwrites 'size'; keep the remote size for the completed-file check
+    file_info.setdefault('source_size', file_info['size'])
     # Sanitize filename for filesystem
-    safe_name = "".join(c for c in file_name if c.isalnum() or c in "._- ")
+    safe_name = _UNSAFE_FILENAME_CHARS.sub('', file_name)
     local_path = temp_dir / safe_name
     
-    # Check if already completed (redundant check, but keep for safety)
-    if state.is_completed(remote_path):
-        logger.info(f"⏭️  Skipping {file_name} - already uploaded successfully (duplicate check)")
-        return True
-    
     # Check if should retry failed file
     if state.is_failed(remote_path) and not state.should_retry(remote_path):
         logger.info(f"⏭️  Skipping {file_name} - exceeded max retry attempts")
-        return False
+        return None
     
+    ext = os.path.splitext(remote_path)[1].lower()
     # Handle ISO files - convert to MKV first
-    is_iso = remote_path.lower().endswith('.iso')
+    is_iso = ext == '.iso'
     # Handle M2TS files - convert to MKV (Google Photos doesn't accept .m2ts)
-    is_m2ts = remote_path.lower().endswith('.m2ts')
+    is_m2ts = ext == '.m2ts'
     
     logger.info("=" * 80)
     logger.info(f"Processing: {remote_path}")
@@ -623,14 +725,14 @@ def process_file(remote: str, file_info: Dict, auth_data: str, temp_dir: Path, s
     # Check available disk space before downloading
     stat = shutil.disk_usage(temp_dir)
     free_space_gb = stat.free / (1024**3)
-    required_space_gb = file_info['size_gb'] + 2  # File size + 2GB buffer
+    required_space_gb = file_info['size_gb'] + DISK_HEADROOM_GB
     
     if free_space_gb < required_space_gb:
         logger.error(f"❌ Insufficient disk space!")
         logger.error(f"   Available: {free_space_gb:.1f}GB")
         logger.error(f"   Required: {required_space_gb:.1f}GB")
         logger.error(f"   Skipping this file (too large for available space)")
-        return False
+        return None
     
     logger.info(f"✓ Disk space check: {free_space_gb:.1f}GB available, {required_space_gb:.1f}GB needed")
     
@@ -645,8 +747,16 @@ def process_file(remote: str, file_info: Dict, auth_data: str, temp_dir: Path, s
         port=server_info['port'],
         remote_path=remote_path,
         local_path=local_path,
-        max_attempts=5
+        max_attempts=5,
+        n_streams=FTP_STREAMS,
+        session=session,
+        # Converted files are re-encoded, so hashing the download is wasted; without a
+        # session there is no downloader left to read the digest from
+        sha1=session is not None and not (is_iso or is_m2ts)
     )
+    # Hand the in-flight SHA-1 to the upload stage. Segmented downloads (FTP_STREAMS > 1)
+    # have none, so gpmc hashes those itself
+    file_info['sha1'] = session.sha1_hex if download_success and session is not None else None
     
     # If ISO file, convert to MKV before upload
     if download_success and is_iso:
@@ -662,7 +772,7 @@ def process_file(remote: str, file_info: Dict, auth_data: str, temp_dir: Path, s
             
             # Delete ISO file to free space (CRITICAL!)
             try:
-                iso_size = local_path.stat().st_size / (1024**3)
+                iso_size = file_info['source_size'] / (1024**3)  # Download matched the remote size exactly
                 local_path.unlink()
                 logger.info(f"🗑️ Deleted ISO file ({iso_size:.2f}GB) to free space")
             except Exception as e:
@@ -704,7 +814,7 @@ def process_file(remote: str, file_info: Dict, auth_data: str, temp_dir: Path, s
             logger.error("❌ ISO conversion failed - skipping upload")
             # Mark as failed
             state.mark_failed(remote_path, "ISO conversion failed")
-            return False
+            return None
     
     # If M2TS file, convert to MKV before upload (Google Photos doesn't accept .m2ts)
     if download_success and is_m2ts:
@@ -721,7 +831,7 @@ def process_file(remote: str, file_info: Dict, auth_data: str, temp_dir: Path, s
             
             # Delete original M2TS file to free space (CRITICAL!)
             try:
-                m2ts_size = local_path.stat().st_size / (1024**3)
+                m2ts_size = file_info['source_size'] / (1024**3)  # Download matched the remote size exactly
                 local_path.unlink()
                 logger.info(f"🗑️ Deleted M2TS file ({m2ts_size:.2f}GB) to free space")
             except Exception as e:
@@ -741,48 +851,47 @@ def process_file(remote: str, file_info: Dict, auth_data: str, temp_dir: Path, s
             logger.error("❌ M2TS conversion failed - skipping upload")
             # Mark as failed
             state.mark_failed(remote_path, "M2TS conversion failed")
-            return False
+            return None
     
     if not download_success:
         error_msg = f"Failed to download after 5 attempts"
         logger.error(f"❌ {error_msg}")
         logger.error(f"⚠️ This file will be retried on next workflow run")
         state.mark_failed(remote_path, error_msg)
-        return False
+        return None
     
-    # Verify file exists - rclone preserves original filename
-    # Check for exact match first, then search for similar names
-    if not local_path.exists():
-        # Try original filename (rclone preserves it)
-        original_local_path = temp_dir / file_name
-        if original_local_path.exists():
-            local_path = original_local_path
-            logger.info(f"Found file with original name: {local_path.name}")
-        else:
-            # Try to find the file by searching for files with similar name
-            parent_files = list(local_path.parent.glob('*'))
-            matching_files = [f for f in parent_files if file_name.lower() in f.name.lower()]
-            
-            if matching_files:
-                local_path = matching_files[0]
-                logger.info(f"Found file with similar name: {local_path.name}")
-            else:
-                logger.error(f"File not found after download: {local_path}")
-                logger.info(f"Expected filename: {file_name}")
-                logger.info(f"Available files: {[f.name for f in parent_files]}")
-                return False
+    # Verify file exists - the downloader writes exactly local_path
+    actual_size = _file_size(local_path)
+    if actual_size is None:
+        logger.error(f"File not found after download: {local_path}")
+        return None
     
     # Verify file size
-    actual_size = local_path.stat().st_size
+    file_info['local_size'] = actual_size  # Reused by the upload stage instead of another stat()
     expected_size = file_info['size']
     size_diff = abs(actual_size - expected_size)
     
-    if size_diff > 10 * 1024 * 1024:  # Allow 10MB difference for FTP inconsistencies
-        logger.warning(f"Size mismatch: expected {expected_size / (1024**3):.2f}GB, "
-                      f"got {actual_size / (1024**3):.2f}GB (diff: {size_diff / (1024**2):.2f}MB)")
+    # download_with_retry only succeeds once the local size equals the server's SIZE,
+    # so any difference here means the remote file changed after it was listed
+    if size_diff:
+        logger.warning(f"Size mismatch with listing: expected {expected_size / (1024**3):.2f}GB, "
+                      f"got {actual_size / (1024**3):.2f}GB (diff: {size_diff / (1024**2):.2f}MB) - "
+                      f"remote file changed since it was listed")
     else:
         logger.info(f"File size verified: {actual_size / (1024**3):.2f}GB")
     
+    return local_path
+
+
+def upload_file(file_info: Dict, local_path: Path, auth_data: str, state: StateManager) -> bool:
+    """
+    Upload stage of process_files_pipelined: upload local_path to Google Photos (into the
+    album matching its FTP folder), record the result in state and delete the local copy.
+    Returns True if successful, False otherwise.
+    """
+    remote_path = file_info['path']
+    file_name = remote_path.rpartition('/')[2]
+    
     # Extract album name from FTP path
     album_name = get_album_name_from_path(remote_path)
     
@@ -805,7 +914,9 @@ def process_file(remote: str, file_info: Dict, auth_data: str, temp_dir: Path, s
         logger.info(f"📁 Target: Root (no folder)")
     logger.info("=" * 80)
     
-    media_key, returned_album_key = upload_to_google_photos(local_path, auth_data, album_name=album_name, album_key=album_key)
+    media_key, returned_album_key = upload_to_google_photos(local_path, auth_data, album_name=album_name, album_key=album_key,
+                                                            sha1_hash=file_info.get('sha1'),
+                                                            file_size=file_info.get('local_size'))
     
     if media_key:
         logger.info("=" * 80)
@@ -818,13 +929,15 @@ def process_file(remote: str, file_info: Dict, auth_data: str, temp_dir: Path, s
         logger.info(f"💾 Quality: ORIGINAL (unlimited)")
         logger.info("=" * 80)
         
-        # Save album key if we created a new one
+        # Save album key if we created a new one - written together with the completion below
+        new_album_key = None
         if album_name and returned_album_key and not album_key:
             logger.info(f"💾 Saving album key for future uploads: {album_name}")
-            state.set_album_key(album_name, returned_album_key)
+            new_album_key = returned_album_key
         
         # Mark as completed in state (saves immediately)
-        state.mark_completed(remote_path, file_info['size'], media_key, album_name=album_name)
+        state.mark_completed(remote_path, file_info['size'], media_key, album_name=album_name,
+                             source_size=file_info.get('source_size'), album_key=new_album_key)
         logger.info("💾 State saved after successful upload")
         
         # Try to upload state as artifact using gh CLI (for persistence if workflow times out)
@@ -849,6 +962,8 @@ def process_file(remote: str, file_info: Dict, auth_data: str, temp_dir: Path, s
         logger.error(f"File: {file_name}")
         logger.error(f"Local file kept at: {local_path}")
         logger.error("=" * 80)
+        # The kept copy won't be read again this run - don't let it crowd the next download out of the page cache
+        _drop_page_cache(local_path)
         
         # Mark as failed in state
         state.mark_failed(remote_path, error_msg)
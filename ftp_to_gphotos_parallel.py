@@ -45,9 +45,18 @@ def upload_when_ready(local_path, auth_data, completion_event):
 # upload_thread.join()  # Wait for upload to finish
 
 """
-CONCLUSION: This doesn't help because:
+CONCLUSION: Overlapping a file's own download and upload doesn't help because:
 - Still need full 30GB on disk at once
 - Just reduces time before upload starts by a few seconds
 - Doesn't solve GitHub Actions 14GB limit
+
+What does help is overlapping the upload of one file with the download of the
+NEXT one. That is implemented in ftp_to_gphotos.process_files_pipelined:
+- Downloads run on the main thread, uploads on a single worker thread
+- At most two files on disk (one uploading, one downloading)
+- If the disk can't hold both, the download waits for the upload first
+More concurrent downloads (e.g. asyncio with a semaphore of 2) would put three
+or more 30GB files on disk at once, and gpmc uploads are blocking calls that
+need a thread either way, so the threaded two-stage pipeline is kept.
 """
 
@@ -10,13 +10,15 @@ import sys
 import subprocess
 import json
 import logging
+import threading
 import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 from datetime import datetime, timezone
 
 try:
-    from ftp_lister import list_directories_with_retry, list_files_with_retry
+    from ftp_lister import FTPLister, FileListing, list_entries_with_retry
 except ImportError:
     print("ERROR: ftp_lister.py not found")
     sys.exit(1)
@@ -42,52 +44,61 @@ CURRENT_SERVER = "Challenger"  # Using Challenger (Blockbuster Movies)
 # FTP credentials (same as ftp_to_gphotos.py for consistency)
 FTP_USER = "Lomusire"
 FTP_PASS = "NoSymbols"
+SERVER_INFO = FTP_SERVERS[CURRENT_SERVER]
+# Directories listed at once (like rclone --checkers) - keep within the server's per-IP connection limit
+TREE_CHECKERS = int(os.environ.get("TREE_CHECKERS", "8"))
 
 
-def list_directories(path: str = "") -> List[str]:
-    """
-    List directories in a path using native Python FTP.
-    Returns list of directory names.
-    """
-    server_info = FTP_SERVERS[CURRENT_SERVER]
-    return list_directories_with_retry(
-        host=server_info['host'],
-        user=FTP_USER,
-        password=FTP_PASS,
-        port=server_info['port'],
-        path=path,
-        max_attempts=3
-    )
+# One FTP login per scan worker, reused for every directory that worker lists
+_worker = threading.local()
+_sessions: List[FTPLister] = []
+
+
+def _worker_session() -> FTPLister:
+    """This thread's FTP session, created on first use (connected by the first listing)."""
+    session = getattr(_worker, 'session', None)
+    if session is None:
+        session = _worker.session = FTPLister(SERVER_INFO['host'], FTP_USER, FTP_PASS,
+                                              SERVER_INFO['port'], use_tls=True)
+        _sessions.append(session)
+    return session
 
 
-def list_all_files(path: str = "") -> List[Dict]:
+def close_sessions():
+    """Log out every worker's FTP session."""
+    while _sessions:
+        _sessions.pop().disconnect()
+
+
+def list_directory(path: str = "") -> Tuple[FileListing, List[str]]:
     """
-    List ALL files in a directory (non-recursive) using native Python FTP.
-    Returns list of dicts with file info.
+    List ALL files and the subdirectories of a directory (non-recursive) using
+    native Python FTP, from one listing over this worker's session.
+    Returns (FileListing, list of directory names).
     """
-    server_info = FTP_SERVERS[CURRENT_SERVER]
-    return list_files_with_retry(
-        host=server_info['host'],
+    return list_entries_with_retry(
+        host=SERVER_INFO['host'],
         user=FTP_USER,
         password=FTP_PASS,
-        port=server_info['port'],
+        port=SERVER_INFO['port'],
         path=path,
-        max_attempts=3
+        max_attempts=3,
+        session=_worker_session()
     )
 
 
-def traverse_ftp_tree(path: str = "", depth: int = 0) -> Dict:
+def scan_directory(path: str) -> Tuple[Dict, List[str]]:
     """
-    Recursively traverse FTP directory structure and build a complete tree.
-    Returns a dictionary representing the directory structure.
+    List one directory's files and subdirectories.
+    Returns its tree node (without subdirectories yet) and the subdirectory paths.
     """
-    indent = "  " * depth
+    indent = "  " * (path.count('/') + 1 if path else 0)
     display_path = path if path else '(root)'
     logger.info(f"{indent}📁 Scanning: {display_path}")
     
     tree_node = {
         'type': 'directory',
-        'name': os.path.basename(path) if path else 'root',
+        'name': path.rpartition('/')[2] if path else 'root',
         'path': path,
         'files': [],
         'subdirectories': [],
@@ -95,85 +106,129 @@ def traverse_ftp_tree(path: str = "", depth: int = 0) -> Dict:
         'total_size': 0
     }
     
-    # List all files in current directory
-    files = list_all_files(path)
+    # List all files and subdirectories in current directory
+    files, subdirs = list_directory(path)
     if files:
-        logger.info(f"{indent}  ✓ Found {len(files)} file(s)")
-        tree_node['files'] = files
+        logger.info(f"{indent}  ✓ Found {len(files)} file(s) in {display_path}")
+        tree_node['files'] = files.as_dicts()
         tree_node['total_files'] = len(files)
-        tree_node['total_size'] = sum(f['size'] for f in files)
+        tree_node['total_size'] = sum(files.sizes)  # Plain int list - summed in C
     
-    # Get subdirectories and recurse
-    subdirs = list_directories(path)
+    # Use forward slashes for paths (consistent with ftp_to_gphotos.py)
     if subdirs:
-        logger.info(f"{indent}  ↳ Found {len(subdirs)} subdirectory(ies)")
-        for subdir in subdirs:
-            # Use forward slashes for paths (consistent with ftp_to_gphotos.py)
-            if path:
-                subpath = f"{path}/{subdir}"
-            else:
-                subpath = subdir
-            
-            # Recursively process subdirectory
-            subtree = traverse_ftp_tree(subpath, depth + 1)
+        logger.info(f"{indent}  ↳ Found {len(subdirs)} subdirectory(ies) in {display_path}")
+    
+    return tree_node, [f"{path}/{subdir}" if path else subdir for subdir in subdirs]
+
+
+def _link_tree(path: str, nodes: Dict[str, Dict], children: Dict[str, List[str]]) -> Dict:
+    """
+    Attach each node's subdirectories in listing order and aggregate counts bottom-up.
+    Iterative, so deep trees can't hit the recursion limit.
+    """
+    # Pre-order with an explicit stack; walked in reverse, every child comes before its parent
+    order = []
+    stack = [path]
+    while stack:
+        dir_path = stack.pop()
+        order.append(dir_path)
+        stack.extend(children[dir_path])
+    
+    for dir_path in reversed(order):
+        tree_node = nodes[dir_path]
+        for subpath in children[dir_path]:
+            subtree = nodes[subpath]
             tree_node['subdirectories'].append(subtree)
-            
-            # Aggregate counts
             tree_node['total_files'] += subtree['total_files']
             tree_node['total_size'] += subtree['total_size']
+    return nodes[path]
+
+
+def traverse_ftp_tree(path: str = "", checkers: int = TREE_CHECKERS) -> Dict:
+    """
+    Traverse FTP directory structure and build a complete tree.
+    Directories are listed breadth-first by a pool of `checkers` workers, so up to
+    that many listing round-trips are in flight instead of one at a time.
+    Returns a dictionary representing the directory structure.
+    """
+    nodes: Dict[str, Dict] = {}
+    children: Dict[str, List[str]] = {}
     
-    return tree_node
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, checkers), thread_name_prefix='scan') as executor:
+            pending = {executor.submit(scan_directory, path)}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    tree_node, subpaths = future.result()
+                    nodes[tree_node['path']] = tree_node
+                    children[tree_node['path']] = subpaths
+                    pending.update(executor.submit(scan_directory, subpath) for subpath in subpaths)
+    finally:
+        close_sessions()
+    
+    return _link_tree(path, nodes, children)
+
+
+# Box-drawing pieces for the text tree
+_BRANCH = "├── "
+_LAST_BRANCH = "└── "
+_PIPE = "│   "
+_SPACE = "    "
 
 
 def generate_text_tree(tree_node: Dict, indent: str = "", is_last: bool = True) -> str:
     """
     Generate a human-readable text representation of the tree structure.
     Uses box-drawing characters for a nice visual tree.
+    Walks the tree with an explicit stack and joins all lines once at the end.
     """
     lines = []
+    stack = [(tree_node, indent, is_last)]
     
-    # Current node
-    name = tree_node['name']
-    total_files = tree_node['total_files']
-    total_size_gb = round(tree_node['total_size'] / (1024**3), 2)
-    
-    prefix = "└── " if is_last else "├── "
-    
-    if tree_node['type'] == 'directory':
-        lines.append(f"{indent}{prefix}📁 {name}/ ({total_files} files, {total_size_gb} GB)")
+    while stack:
+        node, indent, is_last = stack.pop()
+        if node['type'] != 'directory':
+            continue
+        
+        # Current node
+        total_size_gb = round(node['total_size'] / (1024**3), 2)
+        prefix = _LAST_BRANCH if is_last else _BRANCH
+        lines.append(f"{indent}{prefix}📁 {node['name']}/ ({node['total_files']} files, {total_size_gb} GB)")
         
         # Extension for children
-        extension = "    " if is_last else "│   "
+        child_indent = indent + (_SPACE if is_last else _PIPE)
         
         # List files
-        files = tree_node.get('files', [])
-        subdirs = tree_node.get('subdirectories', [])
+        files = node.get('files', [])
+        subdirs = node.get('subdirectories', [])
         
         # Show files first
+        last_file = len(files) - 1
         for i, file_info in enumerate(files):
-            is_last_item = (i == len(files) - 1) and len(subdirs) == 0
-            file_prefix = "└── " if is_last_item else "├── "
+            file_prefix = _LAST_BRANCH if i == last_file and not subdirs else _BRANCH
             file_size = file_info['size_mb']
             size_str = f"{file_info['size_gb']} GB" if file_size >= 1024 else f"{file_size} MB"
-            lines.append(f"{indent}{extension}{file_prefix}📄 {file_info['name']} ({size_str})")
+            lines.append(f"{child_indent}{file_prefix}📄 {file_info['name']} ({size_str})")
         
-        # Show subdirectories
-        for i, subdir in enumerate(subdirs):
-            is_last_subdir = (i == len(subdirs) - 1)
-            lines.append(generate_text_tree(subdir, indent + extension, is_last_subdir))
+        # Then subdirectories - pushed in reverse so the first one is rendered next
+        last_subdir = len(subdirs) - 1
+        for i in range(last_subdir, -1, -1):
+            stack.append((subdirs[i], child_indent, i == last_subdir))
     
     return '\n'.join(lines)
 
 
-def save_manifest(tree: Dict, output_file: str = "ftp_structure_manifest.json"):
+def save_manifest(tree: Dict, output_file: str = "ftp_structure_manifest.json", generated_at: str = None):
     """
     Save the tree structure as a JSON manifest file.
+    generated_at defaults to now; pass the same value to save_text_tree so both outputs match.
     """
     manifest = {
         'metadata': {
-            'generated_at': datetime.now(timezone.utc).isoformat(),
+            'generated_at': generated_at or datetime.now(timezone.utc).isoformat(),
             'server': CURRENT_SERVER,
-            'server_host': FTP_SERVERS[CURRENT_SERVER]['host'],
+            'server_host': SERVER_INFO['host'],
             'note': 'ISO files were converted to MKV during upload to Google Photos'
         },
         'structure': tree,
@@ -186,7 +241,11 @@ def save_manifest(tree: Dict, output_file: str = "ftp_structure_manifest.json"):
     
     try:
         with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(manifest, f, indent=2, ensure_ascii=False)
+            # One compact dumps() runs entirely in json's C encoder (indent, or json.dump's
+            # chunk-by-chunk writes, keep it in Python) - ~3x faster on large trees, and the
+            # string is only ~85 bytes per file. ftp_structure_tree.txt is the human-readable view.
+            # The tree is built fresh from listings and has no cycles, so skip the circular check
+            f.write(json.dumps(manifest, ensure_ascii=False, separators=(',', ':'), check_circular=False))
         logger.info(f"✅ Manifest saved to {output_file}")
         return True
     except Exception as e:
@@ -194,7 +253,7 @@ def save_manifest(tree: Dict, output_file: str = "ftp_structure_manifest.json"):
         return False
 
 
-def save_text_tree(tree_text: str, output_file: str = "ftp_structure_tree.txt"):
+def save_text_tree(tree_text: str, output_file: str = "ftp_structure_tree.txt", generated_at: str = None):
     """
     Save the human-readable tree to a text file.
     """
@@ -202,8 +261,8 @@ def save_text_tree(tree_text: str, output_file: str = "ftp_structure_tree.txt"):
         with open(output_file, 'w', encoding='utf-8') as f:
             f.write("FTP SERVER DIRECTORY STRUCTURE\n")
             f.write("=" * 80 + "\n")
-            f.write(f"Server: {CURRENT_SERVER} ({FTP_SERVERS[CURRENT_SERVER]['host']})\n")
-            f.write(f"Generated: {datetime.now(timezone.utc).isoformat()}\n")
+            f.write(f"Server: {CURRENT_SERVER} ({SERVER_INFO['host']})\n")
+            f.write(f"Generated: {generated_at or datetime.now(timezone.utc).isoformat()}\n")
             f.write("Note: ISO files were converted to MKV during upload to Google Photos\n")
             f.write("=" * 80 + "\n\n")
             f.write(tree_text)
@@ -220,8 +279,9 @@ def main():
     logger.info("FTP STRUCTURE TREE GENERATOR")
     logger.info("=" * 80)
     logger.info(f"Server: {CURRENT_SERVER}")
-    logger.info(f"Host: {FTP_SERVERS[CURRENT_SERVER]['host']}:{FTP_SERVERS[CURRENT_SERVER]['port']}")
+    logger.info(f"Host: {SERVER_INFO['host']}:{SERVER_INFO['port']}")
     logger.info(f"Using: Native Python FTP (ftplib) - same as FTP to GPMC workflow")
+    logger.info(f"Parallel listings: {TREE_CHECKERS}")
     logger.info("")
     
     # Generate the tree
@@ -245,8 +305,9 @@ def main():
         
         # Save outputs
         logger.info("💾 Saving outputs...")
-        manifest_saved = save_manifest(tree)
-        tree_saved = save_text_tree(tree_text)
+        generated_at = datetime.now(timezone.utc).isoformat()
+        manifest_saved = save_manifest(tree, generated_at=generated_at)
+        tree_saved = save_text_tree(tree_text, generated_at=generated_at)
         
         if manifest_saved and tree_saved:
             logger.info("")
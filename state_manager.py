@@ -5,8 +5,9 @@ State manager for tracking upload progress and enabling smart resumption.
 
 import json
 import os
+import threading
 from pathlib import Path
-from typing import Dict, List, Set
+from typing import Dict, List, Tuple
 from datetime import datetime
 
 STATE_FILE = "upload_state.json"
@@ -15,6 +16,8 @@ class StateManager:
     def __init__(self, state_file: str = STATE_FILE):
         self.state_file = Path(state_file)
         self.state = self._load_state()
+        # Downloads and uploads run on different threads and both record state
+        self._lock = threading.RLock()
     
     def _load_state(self) -> Dict:
         """Load state from file or create new state."""
@@ -63,19 +66,33 @@ class StateManager:
     
     def _save_state(self):
         """Save current state to file."""
-        self.state['last_updated'] = datetime.utcnow().isoformat()
-        try:
-            # Write to temp file first, then rename (atomic)
-            temp_file = self.state_file.with_suffix('.tmp')
-            with open(temp_file, 'w') as f:
-                json.dump(self.state, f, indent=2)
-            temp_file.replace(self.state_file)
-        except Exception as e:
-            print(f"Warning: Could not save state: {e}")
-    
-    def is_completed(self, file_path: str) -> bool:
-        """Check if file was already successfully uploaded."""
-        return file_path in self.state['completed']
+        with self._lock:
+            self.state['last_updated'] = datetime.utcnow().isoformat()
+            try:
+                # Write to temp file first, then rename (atomic)
+                temp_file = self.state_file.with_suffix('.tmp')
+                with open(temp_file, 'w') as f:
+                    json.dump(self.state, f, indent=2)
+                temp_file.replace(self.state_file)
+            except Exception as e:
+                print(f"Warning: Could not save state: {e}")
+    
+    def _clear_in_progress(self, file_path: str):
+        """Clear in_progress unless another file has been started since."""
+        in_progress = self.state['in_progress']
+        if in_progress is None or in_progress.get('path') == file_path:
+            self.state['in_progress'] = None
+    
+    def is_completed(self, file_path: str, size_bytes: int = None) -> bool:
+        """
+        Check if file was already successfully uploaded.
+        With size_bytes, a file whose remote size changed since the upload counts as new.
+        """
+        entry = self.state['completed'].get(file_path)
+        if entry is None:
+            return False
+        source_size = entry.get('source_size')  # Not recorded by older state files
+        return size_bytes is None or source_size is None or source_size == size_bytes
     
     def is_failed(self, file_path: str) -> bool:
         """Check if file has failed before."""
@@ -93,62 +110,84 @@ class StateManager:
     
     def mark_in_progress(self, file_path: str, size_bytes: int):
         """Mark file as currently being processed."""
-        self.state['in_progress'] = {
-            'path': file_path,
-            'size': size_bytes,
-            'started_at': datetime.utcnow().isoformat()
-        }
-        self._save_state()
+        with self._lock:
+            self.state['in_progress'] = {
+                'path': file_path,
+                'size': size_bytes,
+                'started_at': datetime.utcnow().isoformat()
+            }
+            self._save_state()
     
-    def mark_completed(self, file_path: str, size_bytes: int, media_key: str, album_name: str = None):
-        """Mark file as successfully uploaded."""
-        if file_path not in self.state['completed']:
-            self.state['stats']['total_uploaded'] += 1
-            self.state['stats']['total_bytes'] += size_bytes
+    def mark_completed(self, file_path: str, size_bytes: int, media_key: str, album_name: str = None,
+                       source_size: int = None, album_key: str = None):
+        """
+        Mark file as successfully uploaded.
+        source_size is the remote file's size, which differs from size_bytes for converted files.
+        album_key records a newly created album in the same state write.
+        """
+        with self._lock:
+            if album_name and album_key:
+                self.state.setdefault('albums', {})[album_name] = album_key
+            
+            if file_path not in self.state['completed']:
+                self.state['stats']['total_uploaded'] += 1
+                self.state['stats']['total_bytes'] += size_bytes
         
-        # Store with media key and metadata (v2.0 format)
-        self.state['completed'][file_path] = {
-            'media_key': media_key,
-            'size': size_bytes,
-            'timestamp': datetime.utcnow().isoformat(),
-            'album_name': album_name  # Store album name for tracking
-        }
+            # Store with media key and metadata (v2.0 format)
+            self.state['completed'][file_path] = {
+                'media_key': media_key,
+                'size': size_bytes,
+                'timestamp': datetime.utcnow().isoformat(),
+                'album_name': album_name,  # Store album name for tracking
+                'source_size': source_size if source_size is not None else size_bytes
+            }
         
-        # Remove from failed if it was there
-        if file_path in self.state['failed']:
-            del self.state['failed'][file_path]
+            # Remove from failed if it was there
+            if file_path in self.state['failed']:
+                del self.state['failed'][file_path]
         
-        self.state['in_progress'] = None
-        self._save_state()
+            self._clear_in_progress(file_path)
+            self._save_state()
     
     def mark_failed(self, file_path: str, reason: str):
         """Mark file as failed."""
-        if file_path not in self.state['failed']:
-            self.state['failed'][file_path] = {
-                'attempts': 0,
-                'last_error': '',
-                'first_failed': datetime.utcnow().isoformat()
-            }
+        with self._lock:
+            if file_path not in self.state['failed']:
+                self.state['failed'][file_path] = {
+                    'attempts': 0,
+                    'last_error': '',
+                    'first_failed': datetime.utcnow().isoformat()
+                }
         
-        self.state['failed'][file_path]['attempts'] += 1
-        self.state['failed'][file_path]['last_error'] = reason
-        self.state['failed'][file_path]['last_failed'] = datetime.utcnow().isoformat()
-        self.state['stats']['total_failed'] += 1
+            self.state['failed'][file_path]['attempts'] += 1
+            self.state['failed'][file_path]['last_error'] = reason
+            self.state['failed'][file_path]['last_failed'] = datetime.utcnow().isoformat()
+            self.state['stats']['total_failed'] += 1
         
-        self.state['in_progress'] = None
-        self._save_state()
+            self._clear_in_progress(file_path)
+            self._save_state()
     
     def mark_skipped(self, file_path: str, reason: str):
         """Mark file as skipped."""
-        if file_path not in self.state['skipped']:
-            self.state['skipped'].append(file_path)
-        self.state['in_progress'] = None
-        self._save_state()
+        with self._lock:
+            if file_path not in self.state['skipped']:
+                self.state['skipped'].append(file_path)
+            self._clear_in_progress(file_path)
+            self._save_state()
     
     def get_completed_files(self) -> List[str]:
         """Get list of completed files."""
         return list(self.state['completed'].keys())
     
+    def get_completed_keys(self) -> Dict[Tuple[str, int], str]:
+        """(lowercased file name, remote size) -> path of every completed file that recorded its size."""
+        with self._lock:
+            return {
+                (os.path.basename(path).lower(), entry['source_size']): path
+                for path, entry in self.state['completed'].items()
+                if entry.get('source_size') is not None
+            }
+    
     def get_failed_files(self) -> Dict:
         """Get dictionary of failed files with details."""
         return self.state['failed']
@@ -172,11 +211,12 @@ class StateManager:
         Store the album key for a given album name.
         This tracks albums we've created to avoid duplicates.
         """
-        # Ensure albums dict exists (for backward compatibility)
-        if 'albums' not in self.state:
-            self.state['albums'] = {}
-        self.state['albums'][album_name] = album_key
-        self._save_state()
+        with self._lock:
+            # Ensure albums dict exists (for backward compatibility)
+            if 'albums' not in self.state:
+                self.state['albums'] = {}
+            self.state['albums'][album_name] = album_key
+            self._save_state()
     
     def print_summary(self):
         """Print a summary of current state."""